@@ -1,13 +1,20 @@
 {
     'name': 'Custom DATEV Export',
     'version': '1.0.4',
-    'depends': ['base', 'account'],
+    'depends': ['base', 'account', 'l10n_de'],
     'external_dependencies': {
         'python': ['dateutil'],
     },
     'data': [
         'security/ir.model.access.csv',
+        'security/datev_export_security.xml',
+        'data/ir_config_parameter.xml',
+        'data/ir_cron.xml',
         'views/export_wizard_view.xml',
+        'views/datev_export_batch_wizard_view.xml',
+        'views/datev_export_job_views.xml',
+        'views/datev_export_cache_views.xml',
+        'views/datev_export_history_views.xml',
     ],
     'installable': True,
     'auto_install': False,
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# Benchmarks werden nicht mit dem Modul geladen, sondern in einer Odoo-Shell gestartet:
+#   from odoo.addons.custom_datev_export.benchmarks import aggregation
+#   aggregation.run(env)
+#   from odoo.addons.custom_datev_export.benchmarks import export_suite
+#   export_suite.run(env, invoice_count=2000)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Vergleich der Kontogruppierung: Schleife pro Rechnungsposition vs. eine Gruppierungsabfrage
+
+Aufruf in einer Odoo-Shell (die Testdaten werden am Ende zurückgerollt)::
+
+    from odoo.addons.custom_datev_export.benchmarks import aggregation
+    aggregation.run(env, invoice_count=2000, lines_per_invoice=5)
+"""
+import logging
+import random
+import time
+from collections import defaultdict
+
+from odoo import Command
+
+_logger = logging.getLogger(__name__)
+
+
+def _legacy_group_invoice_lines_by_account(invoice):
+    """Bisheriger Pfad: Positionen einer Rechnung einzeln durchlaufen"""
+    account_groups = defaultdict(float)
+    for line in invoice.invoice_line_ids:
+        account_code = line.account_id.code if line.account_id else None
+        if not account_code:
+            continue
+        account_groups[account_code] += line.price_total
+    if not account_groups:
+        account_groups['4400'] = invoice.amount_total
+    return dict(account_groups)
+
+
+def generate_invoices(env, invoice_count, lines_per_invoice, account_count=10, seed=42):
+    """Erzeugt synthetische Ausgangsrechnungen mit zufälligen Erlöskonten"""
+    rng = random.Random(seed)
+    company = env.company
+    accounts = env['account.account'].search([
+        ('company_ids', 'in', company.id),
+        ('account_type', '=', 'income'),
+    ], limit=account_count)
+    if not accounts:
+        raise RuntimeError("Keine Erlöskonten für %s gefunden" % company.name)
+    partner = env['res.partner'].create({'name': 'DATEV Benchmark Kunde', 'is_company': True})
+
+    vals_list = []
+    for i in range(invoice_count):
+        vals_list.append({
+            'move_type': 'out_invoice' if i % 5 else 'out_refund',
+            'partner_id': partner.id,
+            'invoice_date': '2024-01-15',
+            'invoice_line_ids': [
+                Command.create({
+                    'name': f'Position {j}',
+                    'quantity': 1,
+                    'price_unit': round(rng.uniform(1, 1000), 2),
+                    'account_id': rng.choice(accounts).id,
+                    'tax_ids': [Command.clear()],
+                })
+                for j in range(lines_per_invoice)
+            ],
+        })
+    return env['account.move'].create(vals_list)
+
+
+def _measure(env, label, func):
+    env.invalidate_all()
+    queries_before = env.cr.sql_log_count
+    start = time.perf_counter()
+    result = func()
+    duration = time.perf_counter() - start
+    queries = env.cr.sql_log_count - queries_before
+    _logger.info("%s: %.3fs, %d Abfragen", label, duration, queries)
+    return result, {'duration': duration, 'queries': queries}
+
+
+def run(env, invoice_count=500, lines_per_invoice=5, account_count=10):
+    """Misst alten und neuen Pfad auf denselben Daten und prüft identische Ergebnisse"""
+    try:
+        invoices = generate_invoices(env, invoice_count, lines_per_invoice, account_count)
+        env.flush_all()
+        wizard = env['export.wizard'].new({})
+
+        legacy, legacy_stats = _measure(env, "Schleife pro Position", lambda: {
+            inv.id: _legacy_group_invoice_lines_by_account(inv) for inv in invoices
+        })
+        grouped, grouped_stats = _measure(env, "Gruppierungsabfrage", lambda: wizard._aggregate_invoice_lines(invoices))
+
+        for invoice in invoices:
+            expected = {code: round(amount, 2) for code, amount in legacy[invoice.id].items()}
+            actual = {code: round(amount, 2) for code, amount in grouped[invoice.id].items()}
+            if expected != actual or list(expected) != list(actual):
+                raise AssertionError(f"Abweichende Gruppierung für {invoice.name}: {expected} != {actual}")
+
+        return {'legacy': legacy_stats, 'grouped': grouped_stats}
+    finally:
+        env.cr.rollback()
+        env.invalidate_all()
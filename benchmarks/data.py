@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Synthetische Buchhaltungsdaten für Benchmarks und Lasttests
+
+Alle Daten werden in der laufenden Transaktion angelegt; der Aufrufer rollt sie zurück.
+PDF-Anhänge landen im Filestore und werden dort erst von der Garbage Collection entfernt.
+"""
+import random
+from datetime import date
+
+from odoo import Command
+
+BENCHMARK_PERIOD = (date(2024, 1, 1), date(2024, 1, 31))
+
+
+def generate_export_data(env, invoice_count=1000, lines_per_invoice=5, account_count=10, partner_count=50,
+                         pdf_size=0, purchase_share=0.0, refund_share=0.2, seed=42):
+    """Erzeugt gebuchte Ausgangs- (und optional Eingangs-)Belege im Zeitraum BENCHMARK_PERIOD
+
+    pdf_size > 0 hängt jedem Beleg ein Haupt-Dokument dieser Größe (Bytes) an,
+    purchase_share ist der Anteil der Eingangsbelege. Liefert die Belege als Recordset.
+    """
+    rng = random.Random(seed)
+    company = env.company
+    accounts = {
+        account_type: env['account.account'].search([
+            ('company_ids', 'in', company.id),
+            ('account_type', '=', account_type),
+        ], limit=account_count)
+        for account_type in ('income', 'expense')
+    }
+    if not accounts['income'] or (purchase_share and not accounts['expense']):
+        raise RuntimeError("Keine Erlös- bzw. Aufwandskonten für %s gefunden" % company.name)
+
+    partners = env['res.partner'].create([{
+        'name': f'DATEV Benchmark Partner {i:05d}',
+        'is_company': bool(i % 4),
+        'vat': f'DE{rng.randint(100000000, 999999999)}' if i % 3 else False,
+    } for i in range(partner_count)])
+
+    start_date, end_date = BENCHMARK_PERIOD
+    vals_list = []
+    for i in range(invoice_count):
+        purchase = rng.random() < purchase_share
+        refund = rng.random() < refund_share
+        move_type = ('in_' if purchase else 'out_') + ('refund' if refund else 'invoice')
+        invoice_date = start_date.replace(day=rng.randint(start_date.day, end_date.day))
+        vals_list.append({
+            'move_type': move_type,
+            'partner_id': rng.choice(partners).id,
+            'invoice_date': invoice_date,
+            'date': invoice_date,
+            'invoice_line_ids': [
+                Command.create({
+                    'name': f'Position {j}',
+                    'quantity': rng.randint(1, 10),
+                    'price_unit': round(rng.uniform(1, 1000), 2),
+                    'account_id': rng.choice(accounts['expense' if purchase else 'income']).id,
+                    'tax_ids': [Command.clear()],
+                })
+                for j in range(lines_per_invoice)
+            ],
+        })
+    moves = env['account.move'].create(vals_list)
+    moves.action_post()
+
+    if pdf_size:
+        attachments = env['ir.attachment'].create([{
+            'name': f'{move.name.replace("/", "_")}.pdf',
+            'raw': rng.randbytes(pdf_size),
+            'mimetype': 'application/pdf',
+            'res_model': 'account.move',
+            'res_id': move.id,
+        } for move in moves])
+        for move, attachment in zip(moves, attachments):
+            move.message_main_attachment_id = attachment
+    env.flush_all()
+    return moves
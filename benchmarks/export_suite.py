@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Last- und Regressionsmessung des kompletten Exports je Exportmodus
+
+Misst für jedes Szenario Laufzeit, SQL-Abfragen und Speicherspitze von Rechnungssuche und
+_write_export_zip (in eine temporäre Datei, wie im Exportauftrag) auf synthetischen Daten und bricht mit AssertionError ab, wenn ein Budget überschritten wird.
+Die Buchungsstapel-Szenarien messen den Live-Pfad ohne Snapshots (datev.booking.snapshot);
+buchungsstapel_snapshot misst denselben Export mit aktuellen Snapshots aller Belege.
+Aufruf in einer Odoo-Shell (die Testdaten werden am Ende zurückgerollt)::
+
+    from odoo.addons.custom_datev_export.benchmarks import export_suite
+    export_suite.run(env, invoice_count=2000, pdf_size=50000)
+
+Im Testlauf prüft tests/test_export_benchmark.py die Budgets über measure().
+"""
+import gc
+import logging
+import tempfile
+import time
+import tracemalloc
+
+from .data import BENCHMARK_PERIOD, generate_export_data
+
+_logger = logging.getLogger(__name__)
+
+# Wizard-Einstellungen je Szenario
+SCENARIOS = {
+    'buchungsstapel': {'export_mode': '21', 'include_attachments': False},
+    'buchungsstapel_pdf': {'export_mode': '21', 'include_attachments': True},
+    'buchungsstapel_snapshot': {'export_mode': '21', 'include_attachments': False},
+    'partner': {'export_mode': '16', 'include_attachments': False, 'is_company_only': False},
+}
+
+# Regressionsbudget je Szenario: Abfragen und Sekunden je 1000 Belege (zzgl. fester Anteil),
+# Speicherspitze absolut, da sie dank stapelweiser Verarbeitung nicht mit der Belegzahl wächst
+BUDGETS = {
+    'buchungsstapel': {'queries_fixed': 40, 'queries_per_1000': 60, 'seconds_per_1000': 15, 'peak_mb': 64},
+    'buchungsstapel_pdf': {'queries_fixed': 40, 'queries_per_1000': 80, 'seconds_per_1000': 20, 'peak_mb': 64},
+    'buchungsstapel_snapshot': {'queries_fixed': 40, 'queries_per_1000': 30, 'seconds_per_1000': 5, 'peak_mb': 64},
+    'partner': {'queries_fixed': 20, 'queries_per_1000': 20, 'seconds_per_1000': 5, 'peak_mb': 32},
+}
+
+
+# Szenarien, die mit aktuellen Snapshots messen; alle übrigen starten ohne Snapshots
+SNAPSHOT_SCENARIOS = {'buchungsstapel_snapshot'}
+
+
+def _prepare_snapshots(env, moves, fresh):
+    """Legt aktuelle Snapshots der Belege an oder entfernt sie (der Live-Pfad trägt sie beim Export nach)"""
+    Snapshot = env['datev.booking.snapshot']
+    if fresh:
+        Snapshot._refresh(moves)
+    else:
+        Snapshot._drop(moves)
+    env.flush_all()
+
+
+def _get_wizard(env, settings):
+    """Gespeicherter Wizard, da neue Datensätze invalidate_all nicht überstehen"""
+    start_date, end_date = BENCHMARK_PERIOD
+    return env['export.wizard'].create({
+        'use_date_range': True,
+        'start_date': start_date,
+        'end_date': end_date,
+        'invoice_type_filter': 'sales_and_purchases',
+        **settings,
+    })
+
+
+def _export(wizard):
+    """Kompletter Export in eine temporäre Datei; liefert Belegzahl und ZIP-Größe"""
+    with tempfile.TemporaryFile() as buffer:
+        invoices = wizard._get_invoices_for_export()
+        wizard._write_export_zip(buffer, invoices)
+        return len(invoices), buffer.tell()
+
+
+def measure_scenario(env, name, settings, moves):
+    """Laufzeit und Abfragen in einem Lauf, Speicherspitze in einem zweiten Lauf mit tracemalloc
+
+    Vor jedem Lauf werden die Snapshots der Belege je nach Szenario angelegt oder entfernt.
+    """
+    wizard = _get_wizard(env, settings)
+    snapshots = name in SNAPSHOT_SCENARIOS
+
+    _prepare_snapshots(env, moves, snapshots)
+    env.invalidate_all()
+    gc.collect()
+    queries_before = env.cr.sql_log_count
+    start = time.perf_counter()
+    invoice_count, zip_size = _export(wizard)
+    duration = time.perf_counter() - start
+    queries = env.cr.sql_log_count - queries_before
+
+    _prepare_snapshots(env, moves, snapshots)
+    env.invalidate_all()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _export(wizard)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'invoices': invoice_count,
+        'duration': duration,
+        'queries': queries,
+        'peak_bytes': peak,
+        'zip_bytes': zip_size,
+    }
+    _logger.info("%s: %d Belege, %.3fs, %d Abfragen, Spitze %.1f MB, ZIP %d Bytes", name, invoice_count,
+                 duration, queries, peak / 1024 / 1024, zip_size)
+    return result
+
+
+def check_budget(name, result, budget):
+    """Liste der überschrittenen Budgets eines Szenarios"""
+    scale = max(result['invoices'], 1) / 1000
+    limits = {
+        'queries': budget['queries_fixed'] + budget['queries_per_1000'] * scale,
+        'duration': budget['seconds_per_1000'] * max(scale, 1),
+        'peak_bytes': budget['peak_mb'] * 1024 * 1024,
+    }
+    return [
+        f"{name}: {key} {result[key]:.0f} > {limit:.0f}"
+        for key, limit in limits.items() if result[key] > limit
+    ]
+
+
+def measure(env, invoice_count=1000, lines_per_invoice=5, account_count=10, partner_count=50, pdf_size=20000,
+            purchase_share=0.3, scenarios=None, budgets=None):
+    """Erzeugt die Daten einmal in der laufenden Transaktion und misst alle Szenarien
+
+    Rollt nichts zurück und kann daher auch aus einem TransactionCase aufgerufen werden.
+    scenarios schränkt die Szenarien ein, budgets überschreibt BUDGETS einzelner Szenarien.
+    Liefert die Messwerte je Szenario und die Liste der überschrittenen Budgets.
+    """
+    budgets = {**BUDGETS, **(budgets or {})}
+    results = {}
+    violations = []
+    moves = generate_export_data(env, invoice_count, lines_per_invoice, account_count, partner_count,
+                         pdf_size=pdf_size, purchase_share=purchase_share)
+    for name in scenarios or SCENARIOS:
+        results[name] = measure_scenario(env, name, SCENARIOS[name], moves)
+        violations += check_budget(name, results[name], budgets[name])
+    return results, violations
+
+
+def run(env, **kwargs):
+    """Misst alle Szenarien in einer Odoo-Shell, rollt die Testdaten zurück und prüft die Budgets"""
+    try:
+        results, violations = measure(env, **kwargs)
+    finally:
+        env.cr.rollback()
+        env.invalidate_all()
+
+    if violations:
+        raise AssertionError("Regressionsbudget überschritten:\n" + '\n'.join(violations))
+    return results
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Vergleich der Zeilenerzeugung: aufgefüllte Listen mit csv.writer vs. CompactRowEncoder
+
+Reines Python ohne Datenbank; Aufruf in einer Odoo-Shell::
+
+    from odoo.addons.custom_datev_export.benchmarks import row_encoding
+    row_encoding.run(row_count=200000)
+"""
+import csv
+import gc
+import logging
+import random
+import time
+import tracemalloc
+from io import StringIO
+
+from ..wizard.export_wizard import BUCHUNGSSTAPEL_ROW, PARTNER_ROW
+
+_logger = logging.getLogger(__name__)
+
+
+def generate_rows(encoder, row_count, seed=42):
+    """Kompakte Zeilen mit typischen Werten; einzelne Werte enthalten Trenn- oder Quote-Zeichen"""
+    rng = random.Random(seed)
+    names = ["Müller GmbH", "Schmidt; Partner", "O'Brien Ltd", "Meier & Söhne KG", "Weber AG"]
+    rows = []
+    for i in range(row_count):
+        values = [f"{rng.uniform(1, 10000):.2f}".replace('.', ',') if j == 0 else rng.choice(names) if j % 3 == 0 else str(i % 97)
+                  for j in range(len(encoder.indices))]
+        rows.append(tuple(values))
+    return rows
+
+
+def _measure(label, func):
+    """Laufzeit ohne und Speicherspitze mit tracemalloc, da tracemalloc die Laufzeit verfälscht"""
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _logger.info("%s: %.3fs, Spitze %d Bytes", label, duration, peak)
+    return {'duration': duration, 'peak_bytes': peak}
+
+
+def _legacy_csv(encoder, rows):
+    """Bisheriger Pfad: je Zeile eine aufgefüllte Liste, geschrieben mit csv.writer.writerows"""
+    output = StringIO()
+    writer = csv.writer(output, delimiter=';', quotechar="'", quoting=csv.QUOTE_MINIMAL)
+    writer.writerows([encoder.expand(row) for row in rows])
+    return output.getvalue()
+
+
+def _compact_csv(encoder, rows):
+    output = StringIO()
+    output.write(encoder.encode_many(rows))
+    return output.getvalue()
+
+
+def run(row_count=100000):
+    """Misst beide Pfade für Buchungsstapel- und Partnerzeilen und prüft identische Ausgabe"""
+    results = {}
+    for name, encoder in (('buchungsstapel', BUCHUNGSSTAPEL_ROW), ('partner', PARTNER_ROW)):
+        rows = generate_rows(encoder, row_count)
+        if _legacy_csv(encoder, rows) != _compact_csv(encoder, rows):
+            raise AssertionError(f"Abweichende CSV-Ausgabe für {name}")
+        legacy = _measure(f"{name}: csv.writer", lambda: _legacy_csv(encoder, rows))
+        compact = _measure(f"{name}: CompactRowEncoder", lambda: _compact_csv(encoder, rows))
+        legacy['rows_per_second'] = row_count / legacy['duration']
+        compact['rows_per_second'] = row_count / compact['duration']
+        results[name] = {'legacy': legacy, 'compact': compact}
+    return results
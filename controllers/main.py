@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from odoo.http import Controller, Stream, request, route
+
+
+class DatevExportController(Controller):
+
+    @route('/datev_export/download/job/<int:job_id>', type='http', auth='user')
+    def download_job(self, job_id):
+        """Liefert die ZIP-Datei eines Exportauftrags direkt aus dem Filestore aus"""
+        job = request.env['datev.export.job'].browse(job_id).exists()
+        if not job or not job.attachment_id:
+            raise request.not_found()
+        job.check_access('read')
+        return self._stream_attachment(job.attachment_id)
+
+    @route('/datev_export/download/cache/<int:entry_id>', type='http', auth='user')
+    def download_cache(self, entry_id):
+        """Liefert eine zwischengespeicherte ZIP-Datei aus"""
+        entry = request.env['datev.export.cache'].browse(entry_id).exists()
+        if not entry:
+            raise request.not_found()
+        entry.check_access('read')
+        return self._stream_attachment(entry.attachment_id)
+
+    def _stream_attachment(self, attachment):
+        """Blockweise Auslieferung (bzw. X-Sendfile) ohne base64 und ohne Kopie im Worker"""
+        stream = Stream.from_attachment(attachment.sudo())
+        return stream.get_response(as_attachment=True)
@@ -0,0 +1,9 @@
+from . import account_account
+from . import account_move
+from . import account_move_line
+from . import datev_booking_snapshot
+from . import datev_export_cache
+from . import datev_export_history
+from . import datev_export_job
+from . import datev_export_ledger
+from . import res_partner
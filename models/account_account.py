@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class AccountAccount(models.Model):
+    _inherit = 'account.account'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'code' in vals:
+            self.env['datev.booking.snapshot'].sudo()._drop_for_accounts(self)
+        return res
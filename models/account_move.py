@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+from odoo.tools import str2bool
+from odoo.tools.sql import create_index
+
+# Partieller Index für die Rechnungssuche des Exports (siehe export.wizard._get_export_domain):
+# Gleichheitsbedingungen zuerst, dann der Datumsbereich; id erlaubt Index-Only-Scans
+DATEV_EXPORT_INDEX = 'account_move_datev_export_idx'
+
+# Felder, deren Änderung die Buchungsstapel-Zeilen einer Buchung beeinflusst (datev.booking.snapshot)
+SNAPSHOT_TRIGGER_FIELDS = {
+    'state', 'move_type', 'company_id', 'partner_id', 'currency_id', 'name', 'invoice_date', 'invoice_date_due',
+    'line_ids', 'invoice_line_ids', 'message_main_attachment_id',
+}
+
+# Belegarten je Rechnungstyp-Filter (Wizards, Exportauftrag, Exportverlauf); Ausgangs- und
+# Eingangsbelege laufen im Export durch denselben Stapel
+SALE_MOVE_TYPES = ('out_invoice', 'out_refund')
+PURCHASE_MOVE_TYPES = ('in_invoice', 'in_refund')
+INVOICE_TYPE_FILTERS = [
+    ('all', 'Rechnungen und Gutschriften'),
+    ('invoices_only', 'Nur Rechnungen'),
+    ('credit_notes_only', 'Nur Gutschriften'),
+    ('purchases', 'Eingangsrechnungen und -gutschriften'),
+    ('sales_and_purchases', 'Ausgangs- und Eingangsbelege'),
+]
+INVOICE_TYPE_MOVE_TYPES = {
+    'all': SALE_MOVE_TYPES,
+    'invoices_only': ('out_invoice',),
+    'credit_notes_only': ('out_refund',),
+    'purchases': PURCHASE_MOVE_TYPES,
+    'sales_and_purchases': SALE_MOVE_TYPES + PURCHASE_MOVE_TYPES,
+}
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    def init(self):
+        super().init()
+        enabled = self.env['ir.config_parameter'].sudo().get_param('custom_datev_export.create_search_index', 'True')
+        if str2bool(enabled, True):
+            create_index(
+                self.env.cr,
+                DATEV_EXPORT_INDEX,
+                self._table,
+                ['company_id', 'move_type', 'invoice_date', 'id'],
+                where="state = 'posted'",
+            )
+
+    def _get_snapshot_moves(self):
+        """Gebuchte Rechnungen; nur für sie führt datev.booking.snapshot Einträge"""
+        return self.filtered(lambda move: move.state == 'posted' and move.is_invoice())
+
+    def write(self, vals):
+        if not SNAPSHOT_TRIGGER_FIELDS.intersection(vals):
+            return super().write(vals)
+        # Entwürfe und sonstige Buchungen haben keinen Snapshot; zurückgesetzte Rechnungen verlieren ihren
+        was_posted = self._get_snapshot_moves()
+        res = super().write(vals)
+        moves = was_posted | self._get_snapshot_moves()
+        if moves:
+            self.env['datev.booking.snapshot'].sudo()._refresh(moves)
+        return res
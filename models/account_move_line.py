@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+# Positionsfelder, die Konto oder Betrag der Buchungsstapel-Zeilen bestimmen (siehe export.wizard._aggregate_invoice_lines)
+SNAPSHOT_LINE_FIELDS = {
+    'move_id', 'account_id', 'display_type', 'quantity', 'price_unit', 'discount', 'tax_ids',
+    'price_subtotal', 'price_total', 'balance', 'amount_currency', 'debit', 'credit',
+}
+
+
+class AccountMoveLine(models.Model):
+    _inherit = 'account.move.line'
+
+    def write(self, vals):
+        # Direkte Änderungen an Positionen (z.B. Konto in der Buchungszeilen-Liste) ändern nicht
+        # das write_date der Buchung; die Snapshots der betroffenen Rechnungen werden verworfen
+        moves = self.move_id if SNAPSHOT_LINE_FIELDS.intersection(vals) else self.env['account.move']
+        res = super().write(vals)
+        if moves:
+            invoices = (moves | self.move_id).filtered(lambda move: move.is_invoice())
+            self.env['datev.booking.snapshot'].sudo()._drop(invoices)
+        return res
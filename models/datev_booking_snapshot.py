@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+
+class DatevBookingSnapshot(models.Model):
+    _name = 'datev.booking.snapshot'
+    _description = 'DATEV Buchungsstapel-Snapshot'
+    _order = 'invoice_date desc, move_id desc'
+
+    move_id = fields.Many2one('account.move', string='Buchung', required=True, readonly=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Unternehmen', required=True, readonly=True)
+    invoice_date = fields.Date(string='Rechnungsdatum', readonly=True)
+    rows = fields.Json(string='Buchungsstapel-Zeilen', readonly=True,
+                       help='Kompakte Buchungsstapel-Zeilen der Buchung (siehe export.wizard._create_datev_line)')
+    move_write_date = fields.Datetime(string='Stand der Buchung', readonly=True,
+                                      help='Letzte Änderung der Buchung zum Zeitpunkt der Berechnung')
+
+    _sql_constraints = [
+        ('move_uniq', 'unique(move_id)', 'Je Buchung gibt es nur einen Snapshot.'),
+    ]
+
+    @api.model
+    def _get_fresh_rows(self, moves):
+        """Zeilen aktueller Snapshots {move_id: [Zeilen]}; veraltete und fehlende Buchungen fehlen"""
+        if not moves:
+            return {}
+        self.flush_model()
+        self.env['account.move'].flush_model(['write_date'])
+        self.env.cr.execute("""
+            SELECT snapshot.move_id, snapshot.rows
+              FROM datev_booking_snapshot snapshot
+              JOIN account_move move ON move.id = snapshot.move_id
+             WHERE snapshot.move_id = ANY(%s)
+               AND snapshot.move_write_date >= move.write_date
+        """, [moves.ids])
+        return {move_id: [tuple(row) for row in rows] for move_id, rows in self.env.cr.fetchall()}
+
+    @api.model
+    def _store(self, rows_by_move):
+        """Legt die Zeilen {move_id: [Zeilen]} als Snapshots an bzw. aktualisiert sie"""
+        if not rows_by_move:
+            return
+        self.env['account.move'].flush_model(['company_id', 'invoice_date', 'write_date'])
+        move_ids = list(rows_by_move)
+        self.env.cr.execute("""
+            INSERT INTO datev_booking_snapshot
+                   (move_id, company_id, invoice_date, rows, move_write_date,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT move.id, move.company_id, move.invoice_date, data.rows::jsonb, move.write_date,
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+              FROM unnest(%(move_ids)s::int[], %(rows)s::varchar[]) AS data(move_id, rows)
+              JOIN account_move move ON move.id = data.move_id
+                ON CONFLICT (move_id) DO UPDATE
+               SET company_id = EXCLUDED.company_id,
+                   invoice_date = EXCLUDED.invoice_date,
+                   rows = EXCLUDED.rows,
+                   move_write_date = EXCLUDED.move_write_date,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+        """, {
+            'uid': self.env.uid,
+            'move_ids': move_ids,
+            'rows': [json.dumps(rows_by_move[move_id]) for move_id in move_ids],
+        })
+        self.invalidate_model()
+
+    @api.model
+    def _refresh(self, moves):
+        """Berechnet die Snapshots gebuchter Rechnungen neu und entfernt die aller übrigen Buchungen"""
+        posted = moves._get_snapshot_moves()
+        self._drop(moves - posted)
+        for company, company_moves in posted.grouped('company_id').items():
+            Wizard = self.env['export.wizard'].with_company(company).with_context(datev_export_keep_cache=True)
+            # Firmenabhängige Personenkonten der Partner im Unternehmen der Buchung lesen
+            self._store(Wizard._compute_booking_rows(company_moves.with_env(Wizard.env)))
+
+    @api.model
+    def _drop(self, moves):
+        """Entfernt die Snapshots der Buchungen; sie werden beim nächsten Export neu berechnet"""
+        if moves:
+            self._drop_where(SQL("move_id = ANY(%s)", moves.ids))
+
+    @api.model
+    def _drop_for_partners(self, partners):
+        """Entfernt die Snapshots der Buchungen dieser Partner und ihrer Kontakte (Name, Personenkonto)"""
+        self.env['account.move'].flush_model(['partner_id'])
+        self._drop_where(SQL("""
+            move_id IN (SELECT move.id
+                          FROM account_move move
+                          JOIN res_partner partner ON partner.id = move.partner_id
+                         WHERE partner.id = ANY(%s) OR partner.parent_id = ANY(%s))
+        """, partners.ids, partners.ids))
+
+    @api.model
+    def _drop_for_accounts(self, accounts):
+        """Entfernt die Snapshots aller Buchungen mit Positionen auf diesen Konten (Kontonummer)"""
+        self.env['account.move.line'].flush_model(['move_id', 'account_id'])
+        self._drop_where(SQL("move_id IN (SELECT move_id FROM account_move_line WHERE account_id = ANY(%s))",
+                             accounts.ids))
+
+    def _drop_where(self, condition):
+        self.flush_model()
+        self.env.cr.execute(SQL("DELETE FROM datev_booking_snapshot WHERE %s", condition))
+        self.invalidate_model()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Standardgrenzen, überschreibbar über Systemparameter
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_CACHE_MAX_AGE_DAYS = 7
+
+
+class DatevExportCache(models.Model):
+    _name = 'datev.export.cache'
+    _description = 'DATEV Export-Cache'
+    _order = 'last_access desc, id desc'
+
+    cache_key = fields.Char(string='Schlüssel', required=True, readonly=True, index=True,
+                            help='Hash aus Unternehmen, Zeitraum, Exportmodus und Filtern')
+    fingerprint = fields.Char(string='Datenstand', required=True, readonly=True,
+                              help='Anzahl und letzte Änderung der Buchungen und Partner beim Export')
+    company_id = fields.Many2one('res.company', string='Unternehmen', required=True, readonly=True)
+    job_id = fields.Many2one('datev.export.job', string='Exportauftrag', readonly=True, ondelete='set null')
+    attachment_id = fields.Many2one('ir.attachment', string='Exportdatei', required=True, readonly=True,
+                                    ondelete='cascade', help='Exportdatei des Auftrags; sie gehört dem Auftrag, nicht dem Cache')
+    file_name = fields.Char(string='Dateiname', readonly=True)
+    file_size = fields.Float(string='Größe (Bytes)', digits=(16, 0), readonly=True)
+    hit_count = fields.Integer(string='Abrufe', readonly=True)
+    last_access = fields.Datetime(string='Letzter Abruf', readonly=True, default=fields.Datetime.now)
+
+    @api.model
+    def _lookup(self, cache_key, fingerprint):
+        """Liefert den Cache-Eintrag für Schlüssel und Datenstand und zählt den Abruf"""
+        entry = self.search([('cache_key', '=', cache_key), ('fingerprint', '=', fingerprint)], limit=1)
+        if entry:
+            entry.sudo().write({'hit_count': entry.hit_count + 1, 'last_access': fields.Datetime.now()})
+            _logger.info("DATEV Export aus Cache ausgeliefert: %s", entry.file_name)
+        return entry
+
+    @api.model
+    def _store(self, job, attachment):
+        """Nimmt die Exportdatei eines fertigen Auftrags in den Cache auf
+
+        Der Eintrag verweist nur auf den Anhang des Auftrags; Verdrängen entfernt den Eintrag,
+        die Datei bleibt am Auftrag (siehe datev.export.job._cron_cleanup_results). Dateien über
+        der Gesamtgrenze werden nicht aufgenommen; der neue Eintrag selbst wird nie sofort verdrängt.
+        """
+        _max_age_days, max_bytes = self._get_limits()
+        if attachment.file_size > max_bytes:
+            _logger.info("DATEV Export-Cache: %s (%d Bytes) überschreitet die Cache-Grenze und wird nicht aufgenommen",
+                         attachment.name, attachment.file_size)
+            return self.browse()
+        self.sudo().search([('cache_key', '=', job.cache_key)]).unlink()
+        entry = self.sudo().create({
+            'cache_key': job.cache_key,
+            'fingerprint': job.cache_fingerprint,
+            'company_id': job.company_id.id,
+            'job_id': job.id,
+            'attachment_id': attachment.id,
+            'file_name': attachment.name,
+            'file_size': attachment.file_size,
+        })
+        self._evict(keep=entry)
+        return entry
+
+    @api.model
+    def _get_limits(self):
+        """Maximales Alter in Tagen und maximale Gesamtgröße in Bytes aus den Systemparametern"""
+        params = self.env['ir.config_parameter'].sudo()
+        max_age_days = int(params.get_param('custom_datev_export.cache_max_age_days', DEFAULT_CACHE_MAX_AGE_DAYS))
+        max_bytes = int(params.get_param('custom_datev_export.cache_max_bytes', DEFAULT_CACHE_MAX_BYTES))
+        return max_age_days, max_bytes
+
+    @api.model
+    def _evict(self, keep=None):
+        """Verdrängt Einträge nach Alter und danach die am längsten nicht abgerufenen nach Gesamtgröße
+
+        keep (z.B. der gerade angelegte Eintrag) wird mitgezählt, aber nicht verdrängt.
+        """
+        max_age_days, max_bytes = self._get_limits()
+        keep = keep or self.browse()
+
+        Cache = self.sudo().with_context(active_test=False)
+        expired = Cache.search([('create_date', '<', fields.Datetime.now() - timedelta(days=max_age_days))])
+        expired.unlink()
+
+        total_size = 0
+        evicted = Cache.browse()
+        for entry in Cache.search([], order='last_access desc, id desc'):
+            total_size += entry.file_size
+            if total_size > max_bytes and entry not in keep:
+                evicted |= entry
+        evicted.unlink()
+        if expired or evicted:
+            _logger.info("DATEV Export-Cache: %d Einträge verdrängt", len(expired) + len(evicted))
+
+    @api.model
+    def _cron_evict(self):
+        self._evict()
+
+    def _get_download_action(self):
+        """Lädt die zwischengespeicherte ZIP-Datei herunter"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/datev_export/download/cache/{self.id}',
+            'target': 'self',
+        }
+
+    def action_download(self):
+        return self._get_download_action()
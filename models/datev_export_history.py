@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+from .account_move import INVOICE_TYPE_FILTERS
+from ..tools.profiling import diff_stage_stats, format_stage_stats
+
+
+class DatevExportHistory(models.Model):
+    _name = 'datev.export.history'
+    _description = 'DATEV Exportverlauf'
+    _order = 'date_finished desc, id desc'
+
+    job_id = fields.Many2one('datev.export.job', string='Exportauftrag', readonly=True, ondelete='set null', index=True)
+    company_id = fields.Many2one('res.company', string='Unternehmen', required=True, readonly=True)
+    user_id = fields.Many2one('res.users', string='Angelegt von', readonly=True)
+    state = fields.Selection([
+        ('done', 'Fertig'),
+        ('failed', 'Fehlgeschlagen'),
+    ], string='Ergebnis', required=True, readonly=True)
+    error_message = fields.Text(string='Fehlermeldung', readonly=True)
+
+    # Zeitraum und Filter
+    export_mode = fields.Selection([
+        ('21', 'Buchungsstapel'),
+        ('16', 'Debitoren/Kreditoren')
+    ], string='Exportmodus', required=True, readonly=True)
+    date_from = fields.Date(string='Von Datum', readonly=True)
+    date_to = fields.Date(string='Bis Datum', readonly=True)
+    invoice_type_filter = fields.Selection(INVOICE_TYPE_FILTERS, string='Rechnungstyp', readonly=True)
+    include_attachments = fields.Boolean(string='Mit PDFs', readonly=True)
+    delta_export = fields.Boolean(string='Delta-Export', readonly=True)
+
+    # Kennzahlen des Laufs
+    date_started = fields.Datetime(string='Gestartet', readonly=True)
+    date_finished = fields.Datetime(string='Beendet', readonly=True)
+    duration = fields.Float(string='Laufzeit (s)', digits=(16, 3), readonly=True, aggregator='avg',
+                            help='Laufzeit dieses Laufs; fortgesetzte Aufträge erhalten je Lauf einen Eintrag')
+    invoice_count = fields.Integer(string='Rechnungen', readonly=True, aggregator='avg',
+                                   help='Rechnungen im Exportzeitraum (gesamter Auftrag)')
+    invoices_processed = fields.Integer(string='Verarbeitet', readonly=True, aggregator='avg',
+                                        help='In diesem Lauf verarbeitete Rechnungen')
+    row_count = fields.Integer(string='Zeilen', readonly=True, aggregator='avg',
+                               help='In diesem Lauf geschriebene Buchungsstapel- bzw. Partnerzeilen')
+    content_bytes = fields.Float(string='Unkomprimiert (Bytes)', digits=(16, 0), readonly=True, aggregator='avg')
+    zip_bytes = fields.Float(string='ZIP-Größe (Bytes)', digits=(16, 0), readonly=True, aggregator='avg')
+    volume_count = fields.Integer(string='Teile', readonly=True, aggregator='max')
+    compression_ratio = fields.Float(string='Kompressionsfaktor', digits=(16, 2), readonly=True, aggregator='avg',
+                                     compute='_compute_ratios', store=True,
+                                     help='Unkomprimierte Größe der Einträge geteilt durch die ZIP-Größe')
+    invoices_per_second = fields.Float(string='Rechnungen/s', digits=(16, 1), readonly=True, aggregator='avg',
+                                       compute='_compute_ratios', store=True,
+                                       help='In diesem Lauf verarbeitete Rechnungen je Sekunde Laufzeit')
+    peak_memory_mb = fields.Float(string='Speicherspitze (MB)', digits=(16, 1), readonly=True, aggregator='max',
+                                  help='Höchster Arbeitsspeicher (RSS) des Worker-Prozesses während des Laufs')
+    stage_stats = fields.Json(string='Phasenkennzahlen', readonly=True,
+                              help='Laufzeit, SQL-Abfragen, Zeilen und Bytes je Phase in diesem Lauf')
+    stage_stats_text = fields.Text(string='Laufzeitanalyse', compute='_compute_stage_stats_text')
+
+    @api.depends('content_bytes', 'zip_bytes', 'invoices_processed', 'duration')
+    def _compute_ratios(self):
+        """Kompressionsfaktor und Durchsatz"""
+        for entry in self:
+            entry.compression_ratio = entry.content_bytes / entry.zip_bytes if entry.zip_bytes else 0.0
+            entry.invoices_per_second = entry.invoices_processed / entry.duration if entry.duration else 0.0
+
+    @api.depends('stage_stats')
+    def _compute_stage_stats_text(self):
+        """Phasenkennzahlen als Tabelle"""
+        for entry in self:
+            entry.stage_stats_text = format_stage_stats(entry.stage_stats)
+
+    @api.model
+    def _record_run(self, job, profiler, date_started, duration, initial_stats=None, initial_invoices_done=0):
+        """Legt den Verlaufseintrag für einen beendeten oder fehlgeschlagenen Lauf eines Auftrags an
+
+        Fortgesetzte Aufträge bringen Kennzahlen und Fortschritt früherer Läufe mit (initial_stats,
+        initial_invoices_done); erfasst werden nur die Anteile dieses Laufs.
+        """
+        stage_stats = diff_stage_stats(profiler.to_dict(), initial_stats)
+        # Ohne Arbeitsdatei beginnt der Auftrag von vorn und setzt den Fortschritt zurück
+        invoices_processed = job.invoices_done - initial_invoices_done
+        if invoices_processed < 0:
+            invoices_processed = job.invoices_done
+        row_stage = 'buchungsstapel_csv' if job.export_mode == '21' else 'partner_csv'
+        done = job.state == 'done'
+        return self.sudo().create({
+            'job_id': job.id,
+            'company_id': job.company_id.id,
+            'user_id': job.user_id.id,
+            'state': 'done' if done else 'failed',
+            'error_message': job.error_message,
+            'export_mode': job.export_mode,
+            'date_from': job.date_from,
+            'date_to': job.date_to,
+            'invoice_type_filter': job.invoice_type_filter,
+            'include_attachments': job.include_attachments,
+            'delta_export': job.delta_export,
+            'date_started': date_started,
+            'date_finished': fields.Datetime.now(),
+            'duration': duration,
+            'invoice_count': job.invoice_count,
+            'invoices_processed': invoices_processed,
+            'row_count': stage_stats.get(row_stage, {}).get('rows', 0),
+            'content_bytes': job.content_bytes if done else 0,
+            'zip_bytes': job.bytes_written if done else 0,
+            'volume_count': job.volume_count,
+            'peak_memory_mb': profiler.peak_rss / 1024 / 1024,
+            'stage_stats': stage_stats,
+        })
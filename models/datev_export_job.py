@@ -0,0 +1,687 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import hashlib
+import io
+import logging
+import os
+import shutil
+import time
+import zipfile
+from contextlib import nullcontext
+from datetime import timedelta
+
+from odoo import models, fields, api, Command, _
+from odoo.exceptions import UserError
+from odoo.tools import config
+
+from .account_move import INVOICE_TYPE_FILTERS
+from ..tools.diagnostics import TRACE_CONTEXT_KEY, ExportTracer
+from ..tools.profiling import PROFILER_CONTEXT_KEY, ExportProfiler, format_stage_stats
+
+_logger = logging.getLogger(__name__)
+
+# Schlüssel für pg_advisory_lock, damit ein Auftrag nur von einem Worker bearbeitet wird
+JOB_LOCK_KEY = 20210016
+
+# Aufbewahrungsfrist der Exportdateien fertiger Aufträge in Tagen (Systemparameter job_retention_days)
+DEFAULT_JOB_RETENTION_DAYS = 30
+
+# Blockgröße beim Hashen und Kopieren von Arbeitsdateien
+FILE_CHUNK_SIZE = 1024 * 1024
+
+# Cronjobs, die Exportaufträge parallel abarbeiten (je Cron ein eigener Worker mit eigenem Cursor)
+JOB_CRON_XMLIDS = (
+    'custom_datev_export.ir_cron_datev_export_job',
+    'custom_datev_export.ir_cron_datev_export_job_worker_2',
+    'custom_datev_export.ir_cron_datev_export_job_worker_3',
+    'custom_datev_export.ir_cron_datev_export_job_worker_4',
+)
+
+
+def _copy_range(source, target, start, end):
+    """Kopiert die Bytes start bis end von source blockweise nach target"""
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(FILE_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def _get_zip_content_size(path):
+    """Summe der unkomprimierten Größen aller Einträge einer ZIP-Datei (aus dem Zentralverzeichnis)"""
+    with zipfile.ZipFile(path) as zip_file:
+        return sum(info.file_size for info in zip_file.infolist())
+
+
+class DatevExportJob(models.Model):
+    _name = 'datev.export.job'
+    _description = 'DATEV Exportauftrag'
+    _order = 'id desc'
+
+    name = fields.Char(string='Bezeichnung', compute='_compute_name', store=True)
+    state = fields.Selection([
+        ('queued', 'Wartend'),
+        ('running', 'In Bearbeitung'),
+        ('done', 'Fertig'),
+        ('failed', 'Fehlgeschlagen'),
+    ], string='Status', default='queued', required=True, readonly=True, index=True)
+    company_id = fields.Many2one('res.company', string='Unternehmen', required=True, readonly=True,
+                                 default=lambda self: self.env.company)
+    user_id = fields.Many2one('res.users', string='Angelegt von', required=True, readonly=True,
+                              default=lambda self: self.env.user)
+
+    # Exportparameter (aus dem Wizard übernommen)
+    export_mode = fields.Selection([
+        ('21', 'Buchungsstapel'),
+        ('16', 'Debitoren/Kreditoren')
+    ], string='Exportmodus', default='21', required=True, readonly=True)
+    date_from = fields.Date(string='Von Datum', readonly=True)
+    date_to = fields.Date(string='Bis Datum', readonly=True)
+    invoice_type_filter = fields.Selection(INVOICE_TYPE_FILTERS, string='Rechnungstyp', default='all', required=True,
+                                           readonly=True)
+    include_attachments = fields.Boolean(string='PDF Rechnungen & document.xml mit exportieren', readonly=True)
+    is_company_only = fields.Boolean(string='Ist Unternehmen', readonly=True)
+    delta_export = fields.Boolean(string='Nur neue/geänderte Buchungen', readonly=True)
+    profile_enabled = fields.Boolean(string='cProfile aufzeichnen', readonly=True,
+                                     help='Speichert zusätzlich ein cProfile-Abbild des Exportlaufs als Anhang')
+    diagnostics_mode = fields.Boolean(string='Diagnosemodus', readonly=True,
+                                      help='Protokolliert eine Stichprobe der Rechnungen als JSONL-Anhang')
+    diagnostics_sample_rate = fields.Float(string='Stichprobe (%)', default=1.0, readonly=True)
+    volume_max_bytes = fields.Float(string='Max. Bytes je Teil', digits=(16, 0), readonly=True,
+                                    help='Grenze für Buchungsstapel-CSV und PDFs je Teil vor der Komprimierung; 0 = keine Grenze')
+    volume_max_rows = fields.Integer(string='Max. Buchungszeilen je Teil', readonly=True,
+                                     help='0 = keine Grenze')
+
+    # Fortschritt
+    invoice_count = fields.Integer(string='Rechnungen gesamt', readonly=True)
+    invoices_done = fields.Integer(string='Rechnungen verarbeitet', readonly=True)
+    bytes_written = fields.Float(string='Geschriebene Bytes', digits=(16, 0), readonly=True)
+    content_bytes = fields.Float(string='Unkomprimierte Bytes', digits=(16, 0), readonly=True,
+                                 help='Summe der Einträge aller ZIP-Dateien vor der Komprimierung')
+    progress = fields.Float(string='Fortschritt', compute='_compute_progress')
+    last_move_id = fields.Integer(string='Zuletzt verarbeitete Rechnung (ID)', readonly=True,
+                                  help='Fortsetzungspunkt: Rechnungen bis zu dieser ID sind bereits geschrieben')
+    csv_bytes = fields.Float(string='Bytes Buchungsstapel', digits=(16, 0), readonly=True,
+                             help='Länge der bereits bestätigten Buchungsstapel-Arbeitsdatei')
+
+    # Ergebnis
+    attachment_id = fields.Many2one('ir.attachment', string='Exportdatei', readonly=True, ondelete='set null')
+    file_name = fields.Char(string='Dateiname', readonly=True)
+    volume_attachment_ids = fields.Many2many('ir.attachment', 'datev_export_job_volume_rel', 'job_id', 'attachment_id',
+                                             string='Teile', readonly=True,
+                                             help='Eigenständige ZIP-Dateien eines mehrteiligen Exports in Reihenfolge')
+    volume_count = fields.Integer(string='Anzahl Teile', compute='_compute_volume_count')
+    date_started = fields.Datetime(string='Gestartet', readonly=True)
+    date_finished = fields.Datetime(string='Beendet', readonly=True)
+    error_message = fields.Text(string='Fehlermeldung', readonly=True)
+    result_message = fields.Char(string='Hinweis', readonly=True,
+                                 help='Gesetzt, wenn der Auftrag ohne Exportdatei beendet wurde')
+    stage_stats = fields.Json(string='Phasenkennzahlen', readonly=True,
+                              help='Laufzeit, SQL-Abfragen, Zeilen und Bytes je Exportphase')
+    stage_stats_text = fields.Text(string='Laufzeitanalyse', compute='_compute_stage_stats_text')
+    profile_attachment_id = fields.Many2one('ir.attachment', string='cProfile-Datei', readonly=True, ondelete='set null')
+    trace_attachment_id = fields.Many2one('ir.attachment', string='Diagnoseprotokoll', readonly=True, ondelete='set null')
+    cache_key = fields.Char(string='Cache-Schlüssel', readonly=True, copy=False,
+                            help='Gesetzt, wenn das Ergebnis im Export-Cache abgelegt werden soll')
+    cache_fingerprint = fields.Char(string='Datenstand', readonly=True, copy=False)
+    ledger_ids = fields.One2many('datev.export.ledger', 'job_id', string='Exportierte Buchungen', readonly=True)
+
+    @api.depends('export_mode', 'date_from', 'date_to')
+    def _compute_name(self):
+        """Bezeichnung aus Exportmodus und Zeitraum"""
+        modes = dict(self._fields['export_mode'].selection)
+        for job in self:
+            if job.export_mode == '21' and job.date_from and job.date_to:
+                job.name = f"{modes[job.export_mode]} {job.date_from} - {job.date_to}"
+            else:
+                job.name = modes.get(job.export_mode, '')
+
+    @api.depends('invoice_count', 'invoices_done', 'state')
+    def _compute_progress(self):
+        """Fortschritt in Prozent der verarbeiteten Rechnungen"""
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            elif job.invoice_count:
+                job.progress = 100.0 * job.invoices_done / job.invoice_count
+            else:
+                job.progress = 0.0
+
+    @api.depends('volume_attachment_ids')
+    def _compute_volume_count(self):
+        for job in self:
+            job.volume_count = len(job.volume_attachment_ids)
+
+    @api.depends('stage_stats')
+    def _compute_stage_stats_text(self):
+        """Phasenkennzahlen als Tabelle"""
+        for job in self:
+            job.stage_stats_text = format_stage_stats(job.stage_stats)
+
+    def unlink(self):
+        self._remove_work_files()
+        return super().unlink()
+
+    @api.model
+    def _cron_cleanup_results(self):
+        """Entfernt die Exportdateien fertiger Aufträge nach der Aufbewahrungsfrist
+
+        Die Frist in Tagen kommt aus custom_datev_export.job_retention_days (0 = unbegrenzt).
+        Aufträge, Exportprotokoll und Verlauf bleiben erhalten; Cache-Einträge auf die Dateien
+        entfallen mit ihnen.
+        """
+        days = int(self.env['ir.config_parameter'].sudo().get_param('custom_datev_export.job_retention_days',
+                                                                     DEFAULT_JOB_RETENTION_DAYS))
+        if days <= 0:
+            return
+        jobs = self.sudo().search([
+            ('state', '=', 'done'),
+            ('date_finished', '<', fields.Datetime.now() - timedelta(days=days)),
+            '|', ('attachment_id', '!=', False), ('volume_attachment_ids', '!=', False),
+        ])
+        if jobs:
+            (jobs.attachment_id | jobs.volume_attachment_ids).unlink()
+            _logger.info("DATEV Export: Exportdateien von %d Aufträgen nach %d Tagen entfernt", len(jobs), days)
+
+    # -------------------------------------------------------------------------
+    # Aktionen
+    # -------------------------------------------------------------------------
+
+    def _get_form_action(self):
+        """Öffnet den Exportauftrag im Formular"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('DATEV Exportauftrag'),
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+    def action_download(self):
+        """Lädt die fertige ZIP-Datei herunter"""
+        self.ensure_one()
+        if self.state != 'done':
+            raise UserError(_('Der Export ist noch nicht abgeschlossen.'))
+        if self.volume_attachment_ids:
+            raise UserError(_('Der Export wurde in %s Teile aufgeteilt. Bitte die Teile einzeln im Auftrag herunterladen.')
+                            % len(self.volume_attachment_ids))
+        if self.result_message:
+            raise UserError(self.result_message)
+        if not self.attachment_id:
+            raise UserError(_('Die Exportdatei wurde nach Ablauf der Aufbewahrungsfrist entfernt. Bitte den Export erneut starten.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/datev_export/download/job/{self.id}',
+            'target': 'self',
+        }
+
+    def action_retry(self):
+        """Setzt fehlgeschlagene Aufträge zurück; bereits geschriebene Stapel bleiben erhalten"""
+        self.filtered(lambda job: job.state == 'failed').write({
+            'state': 'queued',
+            'error_message': False,
+        })
+        self._trigger_processing()
+
+    def _trigger_processing(self):
+        """Stößt so viele Worker-Cronjobs an, wie Aufträge anstehen"""
+        crons = self.env['ir.cron']
+        for xmlid in JOB_CRON_XMLIDS:
+            cron = self.env.ref(xmlid, raise_if_not_found=False)
+            if cron and cron.active:
+                crons |= cron
+        for cron in crons[:max(len(self), 1)]:
+            cron._trigger()
+
+    # -------------------------------------------------------------------------
+    # Verarbeitung
+    # -------------------------------------------------------------------------
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Verarbeitet wartende und unterbrochene Exportaufträge nacheinander"""
+        processed = self.browse()
+        while True:
+            job = self._acquire_next_job(exclude=processed)
+            if not job:
+                break
+            processed |= job
+            try:
+                job._process()
+            finally:
+                job._release_lock()
+
+    @api.model
+    def _acquire_next_job(self, exclude=None):
+        """Sperrt den nächsten offenen Auftrag für diesen Worker
+
+        Die Sperre ist eine Session-Sperre und überdauert daher die Commits nach jedem Stapel.
+        Bricht ein Worker ab, wird sie mit der Datenbankverbindung freigegeben und der Auftrag
+        kann beim nächsten Lauf fortgesetzt werden.
+
+        Die Suche sieht den Stand vom Beginn der Transaktion; ein anderer Worker kann den Auftrag
+        inzwischen beendet und seine Sperre freigegeben haben. Nach dem Sperren wird der Stand
+        daher in einer neuen Transaktion erneut gelesen.
+        """
+        domain = [('state', 'in', ('queued', 'running'))]
+        if exclude:
+            domain.append(('id', 'not in', exclude.ids))
+        for job in self.search(domain, order='id'):
+            self.env.cr.execute("SELECT pg_try_advisory_lock(%s, %s)", (JOB_LOCK_KEY, job.id))
+            if not self.env.cr.fetchone()[0]:
+                continue
+            job._commit_progress()
+            job.invalidate_recordset()
+            if job.exists() and job.state in ('queued', 'running'):
+                return job
+            job._release_lock()
+        return self.browse()
+
+    def _release_lock(self):
+        self.ensure_one()
+        self.env.cr.execute("SELECT pg_advisory_unlock(%s, %s)", (JOB_LOCK_KEY, self.id))
+
+    def _process(self):
+        """Führt den Auftrag aus und protokolliert Fehler am Auftrag"""
+        self.ensure_one()
+        initial_stats = self.stage_stats
+        initial_invoices_done = self.invoices_done
+        profiler = ExportProfiler(self.env.cr, initial=initial_stats)
+        context = {PROFILER_CONTEXT_KEY: profiler}
+        # Die Diagnosedatei wird bei fortgesetzten Läufen weitergeschrieben
+        trace_file = open(self._get_work_path('jsonl'), 'ab') if self.diagnostics_mode else None
+        if trace_file:
+            context[TRACE_CONTEXT_KEY] = ExportTracer(trace_file, self.diagnostics_sample_rate)
+        job = self.with_user(self.user_id).with_company(self.company_id).with_context(**context)
+        profile = cProfile.Profile() if self.profile_enabled else None
+        date_started = fields.Datetime.now()
+        start = time.perf_counter()
+        try:
+            if profile:
+                profile.enable()
+            try:
+                job._run_export()
+            finally:
+                if profile:
+                    profile.disable()
+                if trace_file:
+                    trace_file.close()
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.exception("DATEV Exportauftrag %s fehlgeschlagen", self.id)
+            self.write({
+                'state': 'failed',
+                'error_message': str(e),
+                'date_finished': fields.Datetime.now(),
+                'stage_stats': profiler.to_dict(),
+            })
+            self.env.cr.commit()
+        if profile:
+            path = self._get_work_path('prof')
+            profile.dump_stats(path)
+            self.profile_attachment_id.unlink()
+            self.profile_attachment_id = self._attach_work_file(path, f'datev_export_job_{self.id}.prof', 'application/octet-stream')
+            os.remove(path)
+        if trace_file:
+            path = self._get_work_path('jsonl')
+            self.trace_attachment_id.unlink()
+            self.trace_attachment_id = self._attach_work_file(path, f'datev_export_job_{self.id}_trace.jsonl', 'application/x-ndjson')
+            if self.state == 'done':
+                os.remove(path)
+        self.env['datev.export.history']._record_run(self, profiler, date_started, time.perf_counter() - start,
+                                                     initial_stats, initial_invoices_done)
+        self.env.cr.commit()
+        _logger.info("DATEV Exportauftrag %s Laufzeitanalyse:\n%s", self.id, format_stage_stats(profiler.to_dict()))
+
+    def _attach_work_file(self, path, name, mimetype, keep_file=True):
+        """Legt eine Arbeitsdatei als Anhang des Auftrags ab, ohne sie in den Speicher zu laden
+
+        Bei Ablage im Filestore wird die Datei blockweise gehasht und direkt unter ihrem
+        Prüfsummen-Pfad abgelegt (kein Einlesen, kein base64). Nur bei Ablage in der
+        Datenbank wird der Inhalt gelesen.
+        """
+        IrAttachment = self.env['ir.attachment']
+        vals = {
+            'name': name,
+            'mimetype': mimetype,
+            'res_model': self._name,
+            'res_id': self.id,
+        }
+        if IrAttachment._storage() != 'file':
+            with open(path, 'rb') as work_file:
+                attachment = IrAttachment.create(dict(vals, raw=work_file.read()))
+            if not keep_file:
+                os.remove(path)
+            return attachment
+
+        sha = hashlib.sha1()
+        with open(path, 'rb') as work_file:
+            for chunk in iter(lambda: work_file.read(FILE_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        checksum = sha.hexdigest()
+        store_fname = f'{checksum[:2]}/{checksum}'
+        full_path = IrAttachment._full_path(store_fname)
+        file_size = os.path.getsize(path)
+        if os.path.exists(full_path):
+            if not keep_file:
+                os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if keep_file:
+                shutil.copyfile(path, full_path)
+            else:
+                shutil.move(path, full_path)
+
+        attachment = IrAttachment.create(vals)
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET store_fname = %s, checksum = %s, file_size = %s WHERE id = %s",
+            [store_fname, checksum, file_size, attachment.id],
+        )
+        attachment.invalidate_recordset(['store_fname', 'checksum', 'file_size', 'raw', 'datas', 'db_datas'])
+        return attachment
+
+    def _get_profiler(self):
+        """Profiler des laufenden Auftrags"""
+        return self.env.context.get(PROFILER_CONTEXT_KEY) or ExportProfiler(self.env.cr)
+
+    def _run_export(self):
+        """Schreibt den Buchungsstapel stapelweise und erzeugt anschließend die ZIP-Datei"""
+        self.ensure_one()
+        wizard = self._get_export_wizard()
+        if self.state == 'queued':
+            vals = {'state': 'running', 'date_started': fields.Datetime.now()}
+            if self.cache_key and not self.cache_fingerprint:
+                # Datenstand vor dem ersten Lesen der Buchungen, damit spätere Änderungen den Cache verfehlen;
+                # ein wiederholter Auftrag setzt mit den bereits geschriebenen Stapeln fort und behält ihn
+                vals['cache_fingerprint'] = wizard._get_export_fingerprint()
+            self.write(vals)
+
+        invoices = wizard._get_invoices_for_export()
+        if not invoices and self.export_mode == '21' and self.delta_export:
+            self._finish_without_export(_('Keine neuen oder geänderten Buchungen seit dem letzten Export.'))
+            return
+        if not invoices:
+            raise UserError(_('Keine Rechnungen für den Zeitraum %s bis %s gefunden.') % (self.date_from, self.date_to))
+        self.invoice_count = len(invoices)
+        self._commit_progress()
+
+        csv_path = self._get_work_path('csv')
+        document_index = None
+        if self.export_mode == '21':
+            if self.include_attachments:
+                # Für PDFs und document.xml ohnehin nötig; sonst nur für Rechnungen ohne Snapshot je Stapel
+                document_index = wizard._get_document_index(invoices)
+            self._write_buchungsstapel_work_file(wizard, invoices, csv_path, document_index)
+        else:
+            self.invoices_done = len(invoices)
+
+        if self.export_mode == '21' and self.delta_export:
+            # Anhänge und Partner nur für tatsächlich geschriebene Buchungen
+            invoices = invoices.browse(self.env['datev.export.ledger']._get_job_move_ids(self))
+            if not invoices:
+                self._finish_without_export(_('Keine neuen oder geänderten Buchungen seit dem letzten Export.'))
+                return
+
+        profiler = self._get_profiler()
+        if self._is_split_export():
+            file_name, zip_size, content_size = self._write_volumes(wizard, invoices, csv_path, document_index)
+            self.env['datev.export.ledger']._confirm_exports(self)
+            self.write({
+                'state': 'done',
+                'file_name': file_name,
+                'bytes_written': zip_size,
+                'content_bytes': content_size,
+                'date_finished': fields.Datetime.now(),
+                'stage_stats': profiler.to_dict(),
+            })
+            self._commit_progress()
+            self._remove_work_files(('csv', 'zip', 'idx'))
+            _logger.info("DATEV Exportauftrag %s fertig: %d Teile (%d Bytes)", self.id, self.volume_count, zip_size)
+            return
+
+        zip_path = self._get_work_path('zip')
+        with open(zip_path, 'w+b') as zip_file:
+            if self.export_mode == '21':
+                with open(csv_path, 'rb') as csv_file:
+                    file_name = wizard._write_export_zip(zip_file, invoices, buchungsstapel_file=csv_file,
+                                                         document_index=document_index)
+            else:
+                file_name = wizard._write_export_zip(zip_file, invoices)
+            zip_size = zip_file.tell()
+        content_size = _get_zip_content_size(zip_path)
+        with profiler.stage('attachment_store') as stage:
+            attachment = self._attach_work_file(zip_path, file_name, 'application/zip', keep_file=False)
+            stage.bytes += zip_size
+
+        if self.cache_key and self.cache_fingerprint:
+            self.env['datev.export.cache']._store(self, attachment)
+
+        self.env['datev.export.ledger']._confirm_exports(self)
+        self.write({
+            'state': 'done',
+            'attachment_id': attachment.id,
+            'file_name': file_name,
+            'bytes_written': zip_size,
+            'content_bytes': content_size,
+            'date_finished': fields.Datetime.now(),
+            'stage_stats': profiler.to_dict(),
+        })
+        self._commit_progress()
+        # Diagnoseprotokoll wird erst nach dem Lauf als Anhang übernommen
+        self._remove_work_files(('csv', 'zip'))
+        _logger.info("DATEV Exportauftrag %s fertig: %s (%d Bytes)", self.id, file_name, zip_size)
+
+    def _finish_without_export(self, message):
+        """Beendet einen Delta-Export ohne neue oder geänderte Buchungen ohne Exportdatei"""
+        self.write({
+            'state': 'done',
+            'result_message': message,
+            'date_finished': fields.Datetime.now(),
+            'stage_stats': self._get_profiler().to_dict(),
+        })
+        self._commit_progress()
+        self._remove_work_files(('csv', 'idx'))
+        _logger.info("DATEV Exportauftrag %s fertig: %s", self.id, message)
+
+    def _write_buchungsstapel_work_file(self, wizard, invoices, csv_path, document_index):
+        """Schreibt die Buchungsstapel-CSV stapelweise in die Arbeitsdatei
+
+        Nach jedem Stapel werden Dateilänge und letzte Rechnung festgeschrieben. Ein
+        unterbrochener Auftrag schneidet die Datei auf den letzten bestätigten Stand zurück
+        und setzt mit der nächsten Rechnung fort.
+        """
+        split = self._is_split_export()
+        resume = bool(self.csv_bytes) and os.path.exists(csv_path) \
+            and (not split or os.path.exists(self._get_work_path('idx')))
+        volume_index = self._open_volume_index(resume) if split else None
+        with open(csv_path, 'r+b' if resume else 'w+b') as work_file, volume_index or nullcontext():
+            if resume:
+                work_file.truncate(int(self.csv_bytes))
+                work_file.seek(0, os.SEEK_END)
+                _logger.info("DATEV Exportauftrag %s wird nach Rechnung %s fortgesetzt", self.id, self.last_move_id)
+            else:
+                # Neue Arbeitsdatei: Stand eines früheren Laufs verwerfen, bevor der erste Stapel bestätigt wird
+                self.write({'last_move_id': 0, 'invoices_done': 0, 'csv_bytes': 0, 'bytes_written': 0})
+                self._commit_progress()
+
+            stream = io.TextIOWrapper(work_file, encoding='utf-8', newline='', write_through=True)
+            writer = wizard._get_csv_writer(stream)
+            if not resume:
+                wizard._write_datev_header(writer)
+                writer.writerow(wizard._get_buchungsstapel_header())
+                if volume_index:
+                    # Kopfzeilen: Eintrag 0 markiert das Ende des Dateikopfs
+                    volume_index.write(b'0 %d 0\n' % work_file.tell())
+
+            pending = invoices.browse([move_id for move_id in invoices.ids if move_id > self.last_move_id])
+            Ledger = self.env['datev.export.ledger']
+            profiler = self._get_profiler()
+            # Vorladen übernimmt _iter_buchungsstapel_moves nur für Rechnungen ohne aktuellen Snapshot
+            for batch in wizard._iter_invoice_batches(pending, prefetch=False):
+                row_count = 0
+                content_hashes = {}
+                batch_start = work_file.tell()
+                with profiler.stage('buchungsstapel_csv') as stage:
+                    for invoice, rows in wizard._iter_buchungsstapel_moves(batch, document_index):
+                        stream.write(wizard._encode_buchungsstapel_rows(rows))
+                        row_count += len(rows)
+                        if volume_index:
+                            volume_index.write(b'%d %d %d\n' % (invoice.id, work_file.tell(), len(rows)))
+                        content_hashes[invoice.id] = wizard._get_move_content_hash(rows)
+                    stream.flush()
+                    if volume_index:
+                        volume_index.flush()
+                    stage.rows += row_count
+                    stage.bytes += work_file.tell() - batch_start
+                with profiler.stage('ledger'):
+                    Ledger._record_exports(self, content_hashes)
+                self.write({
+                    'last_move_id': batch.ids[-1],
+                    'invoices_done': self.invoices_done + len(batch),
+                    'csv_bytes': work_file.tell(),
+                    'bytes_written': work_file.tell(),
+                    'stage_stats': profiler.to_dict(),
+                })
+                self._commit_progress()
+                _logger.info("DATEV Exportauftrag %s: %d/%d Rechnungen, %d Zeilen im Stapel",
+                             self.id, self.invoices_done, self.invoice_count, row_count)
+            stream.detach()
+
+    def _is_split_export(self):
+        """Mehrteiliger Buchungsstapel-Export mit Byte- oder Zeilengrenze je Teil"""
+        return self.export_mode == '21' and bool(self.volume_max_bytes or self.volume_max_rows)
+
+    def _open_volume_index(self, resume):
+        """Öffnet die Teile-Indexdatei und verwirft Einträge hinter dem bestätigten Stand der Arbeitsdatei
+
+        Je Rechnung steht dort eine Zeile ``move_id ende zeilen`` mit dem Ende ihrer Buchungszeilen
+        in der Buchungsstapel-Arbeitsdatei; daraus werden die Teile ohne erneutes Lesen der CSV gebildet.
+        """
+        path = self._get_work_path('idx')
+        if not resume:
+            return open(path, 'w+b')
+        index_file = open(path, 'r+b')
+        valid = 0
+        for line in index_file:
+            if int(line.split()[1]) > self.csv_bytes:
+                break
+            valid += len(line)
+        index_file.truncate(valid)
+        index_file.seek(valid)
+        return index_file
+
+    def _iter_volume_index(self):
+        """Einträge der Teile-Indexdatei als (move_id, Ende in der Arbeitsdatei, Zeilen)"""
+        with open(self._get_work_path('idx'), 'rb') as index_file:
+            for line in index_file:
+                move_id, end, rows = line.split()
+                yield int(move_id), int(end), int(rows)
+
+    def _plan_volumes(self, document_index):
+        """Teilt die Rechnungen der Arbeitsdatei in Teile (move_ids, Anfang, Ende in der Arbeitsdatei)
+
+        Gezählt werden die Buchungsstapel-Zeilen und die unkomprimierte Größe von CSV und PDFs.
+        Ein Teil endet vor der Rechnung, mit der eine Grenze überschritten würde; eine einzelne
+        Rechnung über der Grenze bildet einen eigenen Teil. Die Teile werden nacheinander erzeugt,
+        es liegt also nie mehr als ein Teil im Speicher.
+        """
+        entries = self._iter_volume_index()
+        _header, header_end, _rows = next(entries)
+        max_bytes = int(self.volume_max_bytes)
+        max_rows = self.volume_max_rows
+        move_ids, start, size, rows = [], header_end, header_end, 0
+        previous_end = header_end
+        for move_id, end, move_rows in entries:
+            move_size = end - previous_end
+            if self.include_attachments and move_id in document_index:
+                move_size += document_index[move_id].file_size
+            if move_ids and ((max_bytes and size + move_size > max_bytes)
+                             or (max_rows and rows + move_rows > max_rows)):
+                yield move_ids, start, previous_end
+                move_ids, start, size, rows = [], previous_end, header_end, 0
+            move_ids.append(move_id)
+            size += move_size
+            rows += move_rows
+            previous_end = end
+        if move_ids:
+            yield move_ids, start, previous_end
+
+    def _write_volumes(self, wizard, invoices, csv_path, document_index):
+        """Schreibt jeden Teil als eigenständige ZIP-Datei und legt ihn sofort als Anhang ab
+
+        Jeder Teil enthält den Dateikopf und die Buchungszeilen seiner Rechnungen sowie deren
+        Partner, PDFs und document.xml und kann daher unabhängig von den übrigen Teilen
+        hochgeladen werden. Liefert den Dateinamen ohne Teilnummer, die Gesamtgröße und die
+        unkomprimierte Größe aller Teile.
+        """
+        # Ein fortgesetzter Lauf erzeugt alle Teile neu
+        self.volume_attachment_ids.unlink()
+        profiler = self._get_profiler()
+        volume_csv_path = self._get_work_path('part.csv')
+        zip_path = self._get_work_path('zip')
+        header_end = next(self._iter_volume_index())[1]
+        file_name = None
+        total_size = content_size = 0
+        with open(csv_path, 'rb') as csv_file:
+            for number, (move_ids, start, end) in enumerate(self._plan_volumes(document_index), 1):
+                with open(volume_csv_path, 'w+b') as volume_csv:
+                    _copy_range(csv_file, volume_csv, 0, header_end)
+                    _copy_range(csv_file, volume_csv, start, end)
+                    with open(zip_path, 'w+b') as zip_file:
+                        file_name = wizard._write_export_zip(zip_file, invoices.browse(move_ids),
+                                                             buchungsstapel_file=volume_csv,
+                                                             document_index=document_index)
+                        zip_size = zip_file.tell()
+                os.remove(volume_csv_path)
+                content_size += _get_zip_content_size(zip_path)
+                volume_name = f'{os.path.splitext(file_name)[0]}_Teil{number:02d}.zip'
+                with profiler.stage('attachment_store') as stage:
+                    attachment = self._attach_work_file(zip_path, volume_name, 'application/zip', keep_file=False)
+                    stage.bytes += zip_size
+                total_size += zip_size
+                self.write({
+                    'volume_attachment_ids': [Command.link(attachment.id)],
+                    'bytes_written': total_size,
+                    'stage_stats': profiler.to_dict(),
+                })
+                self._commit_progress()
+                _logger.info("DATEV Exportauftrag %s: Teil %d mit %d Rechnungen (%d Bytes)",
+                             self.id, number, len(move_ids), zip_size)
+        return file_name, total_size, content_size
+
+    def _commit_progress(self):
+        """Schreibt den Fortschritt fest, damit er sichtbar ist und ein Abbruch fortgesetzt werden kann"""
+        self.env.cr.commit()
+
+    def _get_export_wizard(self):
+        """Erzeugt einen nicht gespeicherten Wizard mit den Parametern des Auftrags"""
+        self.ensure_one()
+        return self.env['export.wizard'].with_company(self.company_id).new({
+            'export_mode': self.export_mode,
+            'use_date_range': True,
+            'start_date': self.date_from,
+            'end_date': self.date_to,
+            'invoice_type_filter': self.invoice_type_filter,
+            'include_attachments': self.include_attachments,
+            'is_company_only': self.is_company_only,
+            'delta_export': self.delta_export,
+        })
+
+    def _get_work_path(self, extension):
+        """Pfad einer Arbeitsdatei des Auftrags im Datenverzeichnis"""
+        self.ensure_one()
+        directory = os.path.join(config['data_dir'], 'datev_export', self.env.cr.dbname)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f'job_{self.id}.{extension}')
+
+    def _remove_work_files(self, extensions=('csv', 'zip', 'idx', 'part.csv', 'prof', 'jsonl')):
+        for job in self:
+            for extension in extensions:
+                path = job._get_work_path(extension)
+                if os.path.exists(path):
+                    os.remove(path)
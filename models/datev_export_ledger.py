@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class DatevExportLedger(models.Model):
+    _name = 'datev.export.ledger'
+    _description = 'DATEV Exportprotokoll'
+    _order = 'id desc'
+
+    move_id = fields.Many2one('account.move', string='Buchung', required=True, readonly=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Unternehmen', required=True, readonly=True)
+    job_id = fields.Many2one('datev.export.job', string='Exportauftrag', readonly=True, index=True, ondelete='set null',
+                             help='Letzter fertiger Auftrag, der die Buchung exportiert hat')
+    content_hash = fields.Char(string='Inhalts-Hash', readonly=True,
+                               help='SHA-1 über die exportierten Buchungsstapel-Zeilen der Buchung')
+    move_write_date = fields.Datetime(string='Stand der Buchung', readonly=True,
+                                      help='Letzte Änderung der Buchung zum Zeitpunkt des Exports')
+
+    # Stand eines laufenden Auftrags; wird erst mit dessen Abschluss übernommen (_confirm_exports)
+    pending_job_id = fields.Many2one('datev.export.job', string='Laufender Auftrag', readonly=True,
+                                     index='btree_not_null', ondelete='set null')
+    pending_hash = fields.Char(string='Inhalts-Hash (laufend)', readonly=True)
+    pending_write_date = fields.Datetime(string='Stand der Buchung (laufend)', readonly=True)
+
+    # Der Unique-Index (move_id, company_id) dient zugleich den Abfragen im Delta-Export
+    _sql_constraints = [
+        ('move_company_uniq', 'unique(move_id, company_id)', 'Jede Buchung ist nur einmal im Exportprotokoll.'),
+    ]
+
+    @api.model
+    def _get_unchanged_move_ids(self, company, move_ids):
+        """Buchungen, die erfolgreich exportiert und seitdem nicht mehr geändert wurden"""
+        if not move_ids:
+            return set()
+        self.flush_model()
+        self.env['account.move'].flush_model(['write_date'])
+        self.env.cr.execute("""
+            SELECT ledger.move_id
+              FROM datev_export_ledger ledger
+              JOIN account_move move ON move.id = ledger.move_id
+         LEFT JOIN datev_export_job job ON job.id = ledger.job_id
+             WHERE ledger.company_id = %s
+               AND ledger.move_id = ANY(%s)
+               AND ledger.content_hash IS NOT NULL
+               AND (job.id IS NULL OR job.state = 'done')
+               AND ledger.move_write_date >= move.write_date
+        """, [company.id, list(move_ids)])
+        return {move_id for move_id, in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_exported_hashes(self, company, move_ids):
+        """Inhalts-Hashes der zuletzt erfolgreich exportierten Stände {move_id: hash}"""
+        if not move_ids:
+            return {}
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT ledger.move_id, ledger.content_hash
+              FROM datev_export_ledger ledger
+         LEFT JOIN datev_export_job job ON job.id = ledger.job_id
+             WHERE ledger.company_id = %s
+               AND ledger.move_id = ANY(%s)
+               AND ledger.content_hash IS NOT NULL
+               AND (job.id IS NULL OR job.state = 'done')
+        """, [company.id, list(move_ids)])
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _get_job_move_ids(self, job):
+        """IDs der Buchungen, die ein Exportauftrag geschrieben hat (laufend oder abgeschlossen)"""
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT move_id FROM datev_export_ledger WHERE pending_job_id = %s OR job_id = %s ORDER BY move_id
+        """, [job.id, job.id])
+        return [move_id for move_id, in self.env.cr.fetchall()]
+
+    @api.model
+    def _record_exports(self, job, content_hashes):
+        """Trägt die geschriebenen Buchungen {move_id: hash} als laufenden Stand des Auftrags ein
+
+        Der Stand des zuletzt fertigen Exports bleibt erhalten, bis der Auftrag abgeschlossen ist;
+        scheitert er, gelten die Buchungen weiter als mit dem früheren Stand exportiert.
+        """
+        if not content_hashes:
+            return
+        self.env['account.move'].flush_model(['company_id', 'write_date'])
+        move_ids = list(content_hashes)
+        self.env.cr.execute("""
+            INSERT INTO datev_export_ledger
+                   (move_id, company_id, pending_job_id, pending_hash, pending_write_date,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT move.id, move.company_id, %(job_id)s, data.content_hash, move.write_date,
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+              FROM unnest(%(move_ids)s::int[], %(hashes)s::varchar[]) AS data(move_id, content_hash)
+              JOIN account_move move ON move.id = data.move_id
+                ON CONFLICT (move_id, company_id) DO UPDATE
+               SET pending_job_id = EXCLUDED.pending_job_id,
+                   pending_hash = EXCLUDED.pending_hash,
+                   pending_write_date = EXCLUDED.pending_write_date,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+        """, {
+            'job_id': job.id,
+            'uid': self.env.uid,
+            'move_ids': move_ids,
+            'hashes': [content_hashes[move_id] for move_id in move_ids],
+        })
+        self.invalidate_model()
+
+    @api.model
+    def _confirm_exports(self, job):
+        """Übernimmt beim Abschluss des Auftrags dessen Stand als zuletzt exportierten Stand"""
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE datev_export_ledger
+               SET job_id = pending_job_id,
+                   content_hash = pending_hash,
+                   move_write_date = pending_write_date,
+                   pending_job_id = NULL,
+                   pending_hash = NULL,
+                   pending_write_date = NULL,
+                   write_uid = %(uid)s,
+                   write_date = NOW() AT TIME ZONE 'UTC'
+             WHERE pending_job_id = %(job_id)s
+        """, {'job_id': job.id, 'uid': self.env.uid})
+        self.invalidate_model()
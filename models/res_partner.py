@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+# Partnerfelder, die in Buchungsstapel-Zeilen eingehen (Buchungstext, Debitoren-/Kreditorenkonto)
+SNAPSHOT_PARTNER_FIELDS = {'name', 'parent_id', 'property_account_receivable_id', 'property_account_payable_id'}
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if SNAPSHOT_PARTNER_FIELDS.intersection(vals):
+            self.env['datev.booking.snapshot'].sudo()._drop_for_partners(self)
+        return res
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+from . import test_csv_rows
+from . import test_export_benchmark
+from . import test_export_volumes
+from . import test_invoice_aggregation
+from . import test_parallel_zip
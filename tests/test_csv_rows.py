@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+
+from odoo.tests import BaseCase, tagged
+
+from ..tools.csv_rows import CompactRowEncoder
+
+
+@tagged('post_install', '-at_install')
+class TestCompactRowEncoder(BaseCase):
+    """CompactRowEncoder muss zeichengleich mit csv.writer über die aufgefüllte Zeile sein"""
+
+    EDGE_VALUES = [
+        '',
+        'Müller GmbH',
+        'Schmidt; Partner',
+        "O'Brien Ltd",
+        'Text "mit" Anführung',
+        'Zeile 1\nZeile 2',
+        'Zeile 1\r\nZeile 2',
+        'nur\rCR',
+        ' führende und folgende Leerzeichen ',
+        ';',
+        "'",
+        None,
+        1.5,
+        0.1 + 0.2,
+        -1234.5,
+        42,
+        '{0} {}',
+    ]
+
+    def _assert_equal_to_csv_writer(self, encoder, rows):
+        buffer = io.StringIO()
+        # Wie export.wizard._get_csv_writer, mit den Einstellungen des Encoders
+        writer = csv.writer(buffer, delimiter=encoder.delimiter, quotechar=encoder.quotechar,
+                            lineterminator=encoder.lineterminator, quoting=csv.QUOTE_MINIMAL)
+        for row in rows:
+            line_start = buffer.tell()
+            writer.writerow(encoder.expand(row))
+            self.assertEqual(encoder.encode(row), buffer.getvalue()[line_start:], row)
+        self.assertEqual(encoder.encode_many(rows), buffer.getvalue())
+
+    def test_edge_values(self):
+        encoder = CompactRowEncoder(125, (0, 1, 2, 6, 7, 9, 10, 11, 13, 19))
+        rows = [
+            tuple(self.EDGE_VALUES[(offset + position) % len(self.EDGE_VALUES)]
+                  for position in range(len(encoder.indices)))
+            for offset in range(len(self.EDGE_VALUES))
+        ]
+        self._assert_equal_to_csv_writer(encoder, rows)
+
+    def test_each_value_in_each_column(self):
+        encoder = CompactRowEncoder(8, (0, 3, 7))
+        rows = [
+            tuple(value if position == column else 'x' for position in range(3))
+            for value in self.EDGE_VALUES
+            for column in range(3)
+        ]
+        self._assert_equal_to_csv_writer(encoder, rows)
+
+    def test_other_dialects(self):
+        values = [tuple(self.EDGE_VALUES[i:i + 2]) for i in range(0, len(self.EDGE_VALUES) - 1)]
+        for settings in ({'quotechar': '"'}, {'delimiter': ','}, {'lineterminator': '\n'}, {'delimiter': '{'}):
+            with self.subTest(**settings):
+                self._assert_equal_to_csv_writer(CompactRowEncoder(5, (1, 2), **settings), values)
+
+    def test_join_and_expand(self):
+        encoder = CompactRowEncoder(6, (1, 4))
+        self.assertEqual(encoder.expand(('a', 'b')), ['', 'a', '', '', 'b', ''])
+        self.assertEqual(encoder.join(('a', 'b')), ';a;;;b;')
+        self.assertEqual(encoder.join(('a;b', 'c')), ';'.join(encoder.expand(('a;b', 'c'))))
+
+    def test_invalid_indices(self):
+        for indices in ((), (3, 1), (1, 1), (0, 5)):
+            with self.subTest(indices=indices), self.assertRaises(ValueError):
+                CompactRowEncoder(5, indices)
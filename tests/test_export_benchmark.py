@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+from ..benchmarks import export_suite
+
+
+@tagged('-standard', 'post_install', '-at_install', 'datev_export_benchmark')
+class TestExportBenchmark(TransactionCase):
+    """Regressionsbudget des Exports auf synthetischen Daten
+
+    Nur auf Anforderung: odoo-bin --test-tags datev_export_benchmark -d <db> -i custom_datev_export
+    Die Daten entstehen in der Testtransaktion und werden mit ihr zurückgerollt.
+    """
+
+    def test_export_budgets(self):
+        try:
+            results, violations = export_suite.measure(self.env, invoice_count=500, pdf_size=5000)
+        except RuntimeError as e:
+            # Ohne Kontenplan gibt es keine Erlös-/Aufwandskonten für die Testdaten
+            self.skipTest(str(e))
+        self.assertEqual(set(results), set(export_suite.SCENARIOS))
+        self.assertEqual(violations, [])
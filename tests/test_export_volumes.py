@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+from ..wizard.export_wizard import DatevDocument
+
+# Dateikopf der Arbeitsdatei endet bei Byte 100; danach je Rechnung (move_id, Ende, Zeilen)
+HEADER_END = 100
+MOVES = [(1, 200, 2), (2, 300, 2), (3, 400, 2), (4, 500, 2)]
+
+
+@tagged('post_install', '-at_install')
+class TestExportVolumes(TransactionCase):
+    """Aufteilung des Buchungsstapels in Teile anhand der Indexdatei (datev.export.job._plan_volumes)"""
+
+    def _plan(self, moves=MOVES, document_index=None, **vals):
+        job = self.env['datev.export.job'].create({'export_mode': '21', **vals})
+        self.addCleanup(job._remove_work_files, ('idx',))
+        with open(job._get_work_path('idx'), 'wb') as index_file:
+            index_file.write(b'0 %d 0\n' % HEADER_END)
+            for move_id, end, rows in moves:
+                index_file.write(b'%d %d %d\n' % (move_id, end, rows))
+        return list(job._plan_volumes(document_index or {}))
+
+    def _document(self, file_size):
+        return DatevDocument(guid='guid', attachment_id=1, filename='beleg.pdf', document_type=2,
+                             store_fname=False, file_size=file_size)
+
+    def test_without_limits(self):
+        self.assertEqual(self._plan(), [([1, 2, 3, 4], HEADER_END, 500)])
+
+    def test_byte_limit(self):
+        # Jeder Teil enthält den Dateikopf: 100 + 2 * 100 Bytes passen in 350
+        self.assertEqual(self._plan(volume_max_bytes=350), [
+            ([1, 2], HEADER_END, 300),
+            ([3, 4], 300, 500),
+        ])
+
+    def test_oversized_move_gets_own_volume(self):
+        moves = [(1, 200, 1), (2, 1000, 1), (3, 1100, 1)]
+        self.assertEqual(self._plan(moves, volume_max_bytes=350), [
+            ([1], HEADER_END, 200),
+            ([2], 200, 1000),
+            ([3], 1000, 1100),
+        ])
+
+    def test_row_limit(self):
+        self.assertEqual(self._plan(volume_max_rows=5), [
+            ([1, 2], HEADER_END, 300),
+            ([3, 4], 300, 500),
+        ])
+
+    def test_row_and_byte_limit(self):
+        self.assertEqual(self._plan(volume_max_rows=2, volume_max_bytes=10000), [
+            ([1], HEADER_END, 200),
+            ([2], 200, 300),
+            ([3], 300, 400),
+            ([4], 400, 500),
+        ])
+
+    def test_attachments_count_towards_byte_limit(self):
+        document_index = {2: self._document(200)}
+        self.assertEqual(self._plan(document_index=document_index, include_attachments=True, volume_max_bytes=450), [
+            ([1], HEADER_END, 200),
+            ([2], 200, 300),
+            ([3, 4], 300, 500),
+        ])
+        # Ohne PDFs im Export zählen nur die Buchungszeilen
+        self.assertEqual(self._plan(document_index=document_index, volume_max_bytes=450), [
+            ([1, 2, 3], HEADER_END, 400),
+            ([4], 400, 500),
+        ])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from odoo import Command
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+from ..benchmarks.aggregation import _legacy_group_invoice_lines_by_account
+
+
+@tagged('post_install', '-at_install')
+class TestInvoiceLineAggregation(AccountTestInvoicingCommon):
+    """Die Gruppierungsabfrage (_aggregate_invoice_lines) liefert dieselben Konten, Beträge und
+    Reihenfolge wie die frühere Schleife über die Rechnungspositionen"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.revenue = cls.company_data['default_account_revenue']
+        cls.revenue_2 = cls.env['account.account'].create({
+            'name': 'DATEV Test Erlöse 2',
+            'code': '849901',
+            'account_type': 'income',
+        })
+        cls.expense = cls.company_data['default_account_expense']
+        cls.wizard = cls.env['export.wizard'].new({})
+
+    def _line(self, account, price_unit, quantity=1, discount=0, taxes=None):
+        return Command.create({
+            'name': 'Position',
+            'account_id': account.id,
+            'price_unit': price_unit,
+            'quantity': quantity,
+            'discount': discount,
+            'tax_ids': [Command.set(taxes.ids if taxes else [])],
+        })
+
+    def _create_move(self, move_type, lines, partner=None):
+        return self.env['account.move'].create({
+            'move_type': move_type,
+            'partner_id': (partner or self.partner_a).id,
+            'invoice_date': '2024-01-15',
+            'invoice_line_ids': lines,
+        })
+
+    def test_grouping_matches_line_loop(self):
+        moves = self._create_move('out_invoice', [
+            # Zweites Konto vor der zweiten Position des ersten Kontos: Reihenfolge der ersten Position zählt
+            self._line(self.revenue_2, 50),
+            self._line(self.revenue, 100, taxes=self.tax_sale_a),
+            Command.create({'name': 'Abschnitt', 'display_type': 'line_section'}),
+            self._line(self.revenue, 30.5, quantity=3, discount=10, taxes=self.tax_sale_a),
+            Command.create({'name': 'Hinweis', 'display_type': 'line_note'}),
+            self._line(self.revenue_2, 0.1),
+            self._line(self.revenue_2, 0.2),
+        ])
+        moves |= self._create_move('out_refund', [self._line(self.revenue_2, 20)])
+        moves |= self._create_move('out_invoice', [self._line(self.revenue, 1234.56, taxes=self.tax_sale_a)],
+                                   partner=self.partner_b)
+        moves |= self._create_move('in_invoice', [
+            self._line(self.expense, 80, taxes=self.tax_purchase_a),
+            self._line(self.expense, 1.1, quantity=3),
+        ])
+        moves.action_post()
+
+        grouped = self.wizard._aggregate_invoice_lines(moves)
+        for move in moves:
+            expected = {code: round(amount, 2) for code, amount in _legacy_group_invoice_lines_by_account(move).items()}
+            actual = {code: round(amount, 2) for code, amount in grouped[move.id].items()}
+            self.assertEqual(actual, expected, move.name)
+            self.assertEqual(list(actual), list(expected), move.name)
+        self.assertEqual(list(grouped[moves[0].id]), [self.revenue_2.code, self.revenue.code])
+
+    def test_fallback_accounts(self):
+        sale = self._create_move('out_invoice', [])
+        purchase = self._create_move('in_invoice', [])
+        grouped = self.wizard._aggregate_invoice_lines(sale | purchase)
+        self.assertEqual(grouped[sale.id], {'4400': 0.0})
+        self.assertEqual(grouped[purchase.id], {'3400': 0.0})
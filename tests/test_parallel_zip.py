@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import zipfile
+
+from odoo.tests import BaseCase, tagged
+
+from ..tools.parallel_zip import ParallelZipWriter, zip_member_info
+
+
+@tagged('post_install', '-at_install')
+class TestParallelZip(BaseCase):
+    """ZIP-Dateien aus ParallelZipWriter und sequentiell geschriebenen Einträgen müssen gültig sein"""
+
+    def _write_zip(self, workers):
+        row = '1,00;"S";"EUR";;;;"8400";"10000";;"0101";"RE/2024/0001";;;"Text ""mit"" Anführung"\r\n'
+        csv = (row * 5000).encode('utf-8')
+        pdf = os.urandom(200000)
+        xml = b'<archive>' + b'<document guid="00000000-0000-0000-0000-000000000000"/>' * 100 + b'</archive>'
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            with ParallelZipWriter(zip_file, workers) as members:
+                members.add('buchungsstapel.csv', io.BytesIO(csv), 6)
+                members.add_bytes('beleg.pdf', pdf, 0)
+                members.add_bytes('leer.pdf', b'', 0)
+                members.add_bytes('document.xml', xml, 9)
+            zip_file.writestr(zip_member_info('nachtrag.csv', 1), csv)
+            with zip_file.open(zip_member_info('nachtrag.pdf', 0), 'w', force_zip64=True) as member:
+                member.write(pdf)
+        return buffer, {'buchungsstapel.csv': csv, 'beleg.pdf': pdf, 'leer.pdf': b'', 'document.xml': xml,
+                        'nachtrag.csv': csv, 'nachtrag.pdf': pdf}
+
+    def test_parallel_zip_is_valid(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                buffer, expected = self._write_zip(workers)
+                with zipfile.ZipFile(buffer) as zip_file:
+                    self.assertIsNone(zip_file.testzip())
+                    self.assertEqual(zip_file.namelist(), list(expected))
+                    for name, content in expected.items():
+                        self.assertEqual(zip_file.read(name), content, name)
+
+    def test_member_compression(self):
+        buffer, expected = self._write_zip(2)
+        with zipfile.ZipFile(buffer) as zip_file:
+            infos = {info.filename: info for info in zip_file.infolist()}
+        for name in ('buchungsstapel.csv', 'document.xml', 'nachtrag.csv'):
+            self.assertEqual(infos[name].compress_type, zipfile.ZIP_DEFLATED, name)
+            self.assertLess(infos[name].compress_size, len(expected[name]), name)
+        for name in ('beleg.pdf', 'leer.pdf', 'nachtrag.pdf'):
+            self.assertEqual(infos[name].compress_type, zipfile.ZIP_STORED, name)
+            self.assertEqual(infos[name].compress_size, len(expected[name]), name)
@@ -0,0 +1,4 @@
+from . import csv_rows
+from . import diagnostics
+from . import parallel_zip
+from . import profiling
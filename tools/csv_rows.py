@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Kompakte CSV-Zeilen für DATEV-Formate mit wenigen belegten Spalten"""
+import csv
+import io
+import re
+
+
+def _csv_quotes(char, delimiter, quotechar, lineterminator):
+    """Ob csv.writer (QUOTE_MINIMAL) einen Wert mit diesem Zeichen in Quotes setzt"""
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=delimiter, quotechar=quotechar, lineterminator=lineterminator,
+               quoting=csv.QUOTE_MINIMAL).writerow([char])
+    return buffer.getvalue().startswith(quotechar)
+
+
+class CompactRowEncoder:
+    """Schreibt Zeilen, von denen nur wenige Spalten belegt sind, direkt als CSV-Text
+
+    Eine kompakte Zeile ist ein Tupel mit den Werten der belegten Spalten in der
+    Reihenfolge von ``indices``. Die Trennzeichenfolgen dazwischen und die leeren
+    Spalten am Zeilenende werden einmalig vorberechnet. Die Ausgabe ist zeichengleich
+    mit ``csv.writer(..., quoting=csv.QUOTE_MINIMAL)`` über die aufgefüllte Liste.
+    """
+
+    __slots__ = ('width', 'indices', 'delimiter', 'quotechar', 'lineterminator',
+                 '_template', '_raw_template', '_needs_quoting', '_escaped_quote')
+
+    def __init__(self, width, indices, delimiter=';', quotechar="'", lineterminator='\r\n'):
+        indices = tuple(indices)
+        if not indices or list(indices) != sorted(set(indices)) or indices[-1] >= width:
+            raise ValueError("indices müssen aufsteigend und kleiner als width sein")
+        self.width = width
+        self.indices = indices
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.lineterminator = lineterminator
+
+        # Formatvorlage: Trennzeichenfolgen zwischen den belegten Spalten und leere Spalten am Ende
+        escaped = delimiter.replace('{', '{{').replace('}', '}}')
+        gaps = [indices[0]] + [b - a for a, b in zip(indices, indices[1:])]
+        self._raw_template = '{}'.join(escaped * gap for gap in gaps) + '{}' + escaped * (width - 1 - indices[-1])
+        self._template = self._raw_template + lineterminator.replace('{', '{{').replace('}', '}}')
+        # Wie csv.writer: Trennzeichen, Quote-Zeichen und Zeichen des Zeilenendes erzwingen Quotes;
+        # CR/LF außerhalb des Zeilenendes je nach Python-Version, daher bei csv.writer nachgefragt
+        special = set(delimiter + quotechar + lineterminator)
+        special.update(char for char in '\r\n' if _csv_quotes(char, delimiter, quotechar, lineterminator))
+        self._needs_quoting = re.compile('[%s]' % re.escape(''.join(sorted(special)))).search
+        self._escaped_quote = quotechar * 2
+
+    def _field(self, value):
+        if value.__class__ is not str:
+            value = '' if value is None else str(value)
+        if self._needs_quoting(value):
+            quotechar = self.quotechar
+            return quotechar + value.replace(quotechar, self._escaped_quote) + quotechar
+        return value
+
+    def encode(self, values):
+        """CSV-Zeile einschließlich Zeilenende zu einer kompakten Zeile"""
+        try:
+            # Üblicher Fall: kein Wert enthält Sonderzeichen, eine Prüfung für die ganze Zeile genügt
+            plain = not self._needs_quoting(''.join(values))
+        except TypeError:
+            plain = False
+        if plain:
+            return self._template.format(*values)
+        return self._template.format(*map(self._field, values))
+
+    def encode_many(self, rows):
+        """Mehrere Zeilen als ein zusammenhängender Text"""
+        return ''.join(map(self.encode, rows))
+
+    def join(self, values):
+        """Unquotierte Verkettung, identisch mit ``delimiter.join(self.expand(values))``"""
+        return self._raw_template.format(*values)
+
+    def expand(self, values):
+        """Aufgefüllte Liste mit ``width`` Spalten, wie sie csv.writer erwartet"""
+        row = [''] * self.width
+        for index, value in zip(self.indices, values):
+            row[index] = value
+        return row
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Stichprobenartige Ablaufverfolgung einzelner Rechnungen (JSON Lines)"""
+import json
+
+# Kontextschlüssel, unter dem der aktive Tracer an die Wizard-Methoden weitergereicht wird
+TRACE_CONTEXT_KEY = 'datev_export_tracer'
+
+# Multiplikativer Hash (Knuth), damit die Stichprobe gleichmäßig über die IDs streut
+_SAMPLE_MULTIPLIER = 2654435761
+_SAMPLE_BUCKETS = 10000
+
+
+class ExportTracer:
+    """Schreibt je ausgewählter Rechnung einen JSON-Datensatz in eine Binärdatei
+
+    Die Auswahl hängt nur von der ID ab; wiederholte Läufe verfolgen dieselben Rechnungen.
+    """
+
+    def __init__(self, stream, sample_percent):
+        self.stream = stream
+        self.threshold = round(max(0.0, min(sample_percent, 100.0)) * _SAMPLE_BUCKETS / 100)
+        self.count = 0
+
+    def is_sampled(self, record_id):
+        return (record_id * _SAMPLE_MULTIPLIER) % _SAMPLE_BUCKETS < self.threshold
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, default=str, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.count += 1
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Parallele Komprimierung von ZIP-Einträgen in einem Thread-Pool"""
+import shutil
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Blockgröße beim Lesen, Komprimieren und Anhängen der Einträge
+CHUNK_SIZE = 1024 * 1024
+
+# Fertig komprimierter Eintrag; data ist eine temporäre Datei mit den komprimierten Bytes
+CompressedMember = namedtuple('CompressedMember', ['data', 'compress_type', 'crc', 'file_size', 'compress_size'])
+
+
+def compress_member(source, level, close_source=False):
+    """Komprimiert source (Pfad oder Binärdatei) blockweise in eine temporäre Datei
+
+    Stufe 0 legt den Eintrag unkomprimiert ab (ZIP_STORED), sonst raw deflate wie im ZIP-Format.
+    zlib gibt während der Komprimierung den GIL frei, daher lohnt sich der Aufruf in Threads.
+    """
+    opened = isinstance(source, str)
+    stream = open(source, 'rb') if opened else source
+    target = tempfile.TemporaryFile()
+    try:
+        if not opened:
+            stream.seek(0)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if level else None
+        crc = file_size = 0
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            target.write(compressor.compress(chunk) if compressor else chunk)
+        if compressor:
+            target.write(compressor.flush())
+    except BaseException:
+        target.close()
+        raise
+    finally:
+        if opened or close_source:
+            stream.close()
+    return CompressedMember(
+        data=target,
+        compress_type=zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED,
+        crc=crc,
+        file_size=file_size,
+        compress_size=target.tell(),
+    )
+
+
+def zip_member_info(name, level):
+    """ZipInfo für einen neuen Eintrag: Stufe 0 unkomprimiert (ZIP_STORED), sonst deflate mit dieser Stufe
+
+    Für ZipFile.open(..., 'w') und writestr, die sonst Methode und Stufe der ZIP-Datei verwenden.
+    """
+    zinfo = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    zinfo.external_attr = 0o600 << 16
+    zinfo.compress_type = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+    zinfo._compresslevel = level or None
+    return zinfo
+
+
+class ParallelZipWriter:
+    """Komprimiert Einträge parallel und hängt sie in Aufrufreihenfolge an die ZIP-Datei an
+
+    Es sind höchstens ``2 * max_workers`` Einträge gleichzeitig in Arbeit, fertige Einträge
+    werden sofort angehängt; der Plattenbedarf der Zwischendateien bleibt damit begrenzt.
+    Das Anhängen schreibt Local File Header und Daten selbst, da zipfile keine öffentliche
+    Schnittstelle für bereits komprimierte Daten bietet.
+    """
+
+    def __init__(self, zip_file, max_workers):
+        self.zip_file = zip_file
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='datev_zip')
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def add(self, name, source, level, close_source=False):
+        """Reiht einen Eintrag aus Pfad oder Binärdatei ein; close_source schließt die Datei danach"""
+        future = self._executor.submit(compress_member, source, level, close_source)
+        self._pending.append((name, future))
+        self._drain(block=len(self._pending) > 2 * self.max_workers)
+
+    def add_bytes(self, name, data, level):
+        """Reiht einen Eintrag aus Bytes ein"""
+        buffer = tempfile.SpooledTemporaryFile(CHUNK_SIZE)
+        buffer.write(data)
+        self.add(name, buffer, level, close_source=True)
+
+    def close(self):
+        """Wartet auf alle Einträge und hängt sie an"""
+        try:
+            while self._pending:
+                self._drain(block=True)
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _abort(self):
+        for _name, future in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for _name, future in self._pending:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().data.close()
+        self._pending.clear()
+
+    def _drain(self, block):
+        """Hängt fertige Einträge vom Anfang der Warteschlange an; block wartet auf den ersten"""
+        while self._pending and (block or self._pending[0][1].done()):
+            name, future = self._pending.popleft()
+            member = future.result()
+            try:
+                self._append(name, member)
+            finally:
+                member.data.close()
+            block = False
+
+    def _append(self, name, member):
+        zip_file = self.zip_file
+        zinfo = zip_member_info(name, 0)
+        zinfo.compress_type = member.compress_type
+        zinfo.CRC = member.crc
+        zinfo.file_size = member.file_size
+        zinfo.compress_size = member.compress_size
+
+        # Entspricht ZipFile._open_to_write/_ZipWriteFile.close mit vorab bekannten Größen
+        if zip_file._seekable:
+            zip_file.fp.seek(zip_file.start_dir)
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(zinfo)
+        zip_file._didModify = True
+        zip_file.fp.write(zinfo.FileHeader())
+        member.data.seek(0)
+        shutil.copyfileobj(member.data, zip_file.fp, CHUNK_SIZE)
+        zip_file.filelist.append(zinfo)
+        zip_file.NameToInfo[zinfo.filename] = zinfo
+        zip_file.start_dir = zip_file.fp.tell()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Messung der Exportphasen (Laufzeit, SQL-Abfragen, Zeilen, Bytes, Speicherspitze)"""
+import time
+from contextlib import contextmanager
+
+import psutil
+
+# Kontextschlüssel, unter dem der aktive Profiler an die Wizard-Methoden weitergereicht wird
+PROFILER_CONTEXT_KEY = 'datev_export_profiler'
+
+
+class StageStats:
+    """Kennzahlen einer Exportphase; Zeilen und Bytes trägt die gemessene Methode selbst ein"""
+
+    __slots__ = ('calls', 'duration', 'self_duration', 'queries', 'rows', 'bytes')
+
+    def __init__(self, calls=0, duration=0.0, self_duration=0.0, queries=0, rows=0, bytes=0):
+        self.calls = calls
+        self.duration = duration
+        self.self_duration = self_duration
+        self.queries = queries
+        self.rows = rows
+        self.bytes = bytes
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'duration': round(self.duration, 6),
+            'self_duration': round(self.self_duration, 6),
+            'queries': self.queries,
+            'rows': self.rows,
+            'bytes': self.bytes,
+        }
+
+
+class ExportProfiler:
+    """Sammelt Kennzahlen je Phase über alle Aufrufe eines Exports
+
+    Phasen dürfen verschachtelt sein (z.B. Kontogruppierung innerhalb der CSV-Erzeugung).
+    ``duration`` enthält die Unterphasen, ``self_duration`` nur die eigene Zeit.
+    ``peak_rss`` ist der höchste Arbeitsspeicher (RSS) des Prozesses am Ende einer Phase
+    in diesem Lauf.
+    """
+
+    def __init__(self, cr, initial=None):
+        self.cr = cr
+        self.stages = {name: StageStats(**values) for name, values in (initial or {}).items()}
+        self.peak_rss = 0
+        self._process = psutil.Process()
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        stats = self.stages.setdefault(name, StageStats())
+        queries_before = self.cr.sql_log_count
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            yield stats
+        finally:
+            duration = time.perf_counter() - start
+            child_duration = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += duration
+            stats.calls += 1
+            stats.duration += duration
+            stats.self_duration += duration - child_duration
+            stats.queries += self.cr.sql_log_count - queries_before
+            self.peak_rss = max(self.peak_rss, self._process.memory_info().rss)
+
+    def add(self, name, rows=0, bytes=0):
+        """Ergänzt Zeilen/Bytes einer Phase, die erst nach ihrem Ende bekannt sind"""
+        stats = self.stages.setdefault(name, StageStats())
+        stats.rows += rows
+        stats.bytes += bytes
+
+    def to_dict(self):
+        return {name: stats.to_dict() for name, stats in self.stages.items()}
+
+
+def diff_stage_stats(stage_stats, initial):
+    """Kennzahlen je Phase abzüglich eines früheren Stands (z.B. der Kennzahlen vorheriger Läufe)"""
+    initial = initial or {}
+    result = {}
+    for name, values in stage_stats.items():
+        before = initial.get(name, {})
+        delta = {key: value - before.get(key, 0) for key, value in values.items()}
+        if delta['calls']:
+            result[name] = delta
+    return result
+
+
+@contextmanager
+def null_stage():
+    """Ersatz für ExportProfiler.stage, wenn nicht gemessen wird"""
+    yield StageStats()
+
+
+def format_stage_stats(stage_stats):
+    """Tabellarische Textdarstellung der Phasenkennzahlen"""
+    if not stage_stats:
+        return ''
+    lines = [f"{'Phase':<22} {'Aufrufe':>8} {'Zeit s':>10} {'eigene s':>10} {'SQL':>8} {'Zeilen':>10} {'Bytes':>14}"]
+    for name, values in sorted(stage_stats.items(), key=lambda item: -item[1]['duration']):
+        lines.append(
+            f"{name:<22} {values['calls']:>8} {values['duration']:>10.3f} {values['self_duration']:>10.3f} "
+            f"{values['queries']:>8} {values['rows']:>10} {values['bytes']:>14}"
+        )
+    return '\n'.join(lines)
@@ -1 +1,2 @@
-from . import export_wizard
\ No newline at end of file
+from . import export_wizard
+from . import datev_export_batch_wizard
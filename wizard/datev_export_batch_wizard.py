@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+from dateutil.relativedelta import relativedelta
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+
+from ..models.account_move import INVOICE_TYPE_FILTERS
+
+
+class DatevExportBatchWizard(models.TransientModel):
+    _name = 'datev.export.batch.wizard'
+    _description = 'DATEV Export für mehrere Unternehmen'
+
+    company_ids = fields.Many2many(
+        'res.company',
+        string='Unternehmen',
+        required=True,
+        default=lambda self: self.env.companies,
+        # Nur die im Unternehmensumschalter aktiven Unternehmen; die Aufträge anderer wären für den Benutzer unsichtbar
+        domain=lambda self: [('id', 'in', self.env.companies.ids)],
+        help='Für jedes Unternehmen wird ein eigener Exportauftrag mit eigener ZIP-Datei angelegt; '
+             'es laufen höchstens vier Aufträge gleichzeitig, weitere warten auf einen freien Worker'
+    )
+    date_from = fields.Date(string='Von Datum', required=True,
+                            default=lambda self: date.today().replace(day=1) - relativedelta(months=1))
+    date_to = fields.Date(string='Bis Datum', required=True,
+                          default=lambda self: date.today().replace(day=1) - relativedelta(days=1))
+    invoice_type_filter = fields.Selection(INVOICE_TYPE_FILTERS, string='Rechnungstyp', default='all', required=True)
+    include_attachments = fields.Boolean(string='PDF Rechnungen & document.xml mit exportieren', default=True)
+    delta_export = fields.Boolean(string='Nur neue/geänderte Buchungen', default=False)
+
+    @api.constrains('date_from', 'date_to')
+    def _check_dates(self):
+        """Validierung des Zeitraums"""
+        for record in self:
+            if record.date_from > record.date_to:
+                raise ValidationError(_("Das Von-Datum muss vor dem Bis-Datum liegen."))
+
+    def action_export(self):
+        """Legt je Unternehmen einen Exportauftrag an; die Aufträge laufen parallel"""
+        self.ensure_one()
+        if not self.company_ids:
+            raise UserError(_("Bitte mindestens ein Unternehmen auswählen."))
+        inactive = self.company_ids - self.env.companies
+        if inactive:
+            raise UserError(_("Bitte die Unternehmen %s zuerst im Unternehmensumschalter aktivieren.",
+                              ', '.join(inactive.mapped('name'))))
+
+        jobs = self.env['datev.export.job'].create([{
+            'company_id': company.id,
+            'export_mode': '21',
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'invoice_type_filter': self.invoice_type_filter,
+            'include_attachments': self.include_attachments,
+            'is_company_only': False,
+            'delta_export': self.delta_export,
+        } for company in self.company_ids])
+        jobs._trigger_processing()
+
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('DATEV Exportaufträge'),
+            'res_model': 'datev.export.job',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', jobs.ids)],
+            'target': 'current',
+        }
@@ -1,20 +1,82 @@
 # -*- coding: utf-8 -*-
-import base64
 import csv
 import io
 import zipfile
 import logging
+import os
 import calendar
-from io import StringIO
-from collections import defaultdict
-from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
+import hashlib
+import json
+import shutil
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, date, timedelta
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_repr
+from odoo.tools import SQL, float_repr, split_every
+from odoo.tools.lru import LRU
+from odoo.tools.misc import human_size
+
+from ..models.account_move import (
+    DATEV_EXPORT_INDEX, INVOICE_TYPE_FILTERS, INVOICE_TYPE_MOVE_TYPES, PURCHASE_MOVE_TYPES, SALE_MOVE_TYPES,
+)
+from ..tools.csv_rows import CompactRowEncoder
+from ..tools.diagnostics import TRACE_CONTEXT_KEY
+from ..tools.parallel_zip import ParallelZipWriter, zip_member_info
+from ..tools.profiling import PROFILER_CONTEXT_KEY, null_stage
 
 _logger = logging.getLogger(__name__)
 
+# Anzahl Rechnungen, die pro Stapel gelesen und in den Export geschrieben werden
+EXPORT_BATCH_SIZE = 1000
+# Soll/Haben-Kennzeichen aus Sicht des Sachkontos (Spalte Konto), Gegenkonto ist der Personenkonto
+SOLL_HABEN = {'out_invoice': 'H', 'out_refund': 'S', 'in_invoice': 'S', 'in_refund': 'H'}
+# Sachkonto für Belege ohne Positionen mit Konto (SKR03: Erlöse 19 % bzw. Wareneingang 19 %)
+FALLBACK_SALE_ACCOUNT = '4400'
+FALLBACK_PURCHASE_ACCOUNT = '3400'
+# Modelle, deren ORM-Cache nach jedem Stapel geleert wird
+EXPORT_CACHE_MODELS = ('account.move', 'account.move.line', 'res.partner', 'account.account', 'ir.attachment')
+# Blockgröße beim Kopieren von Anhängen aus dem Filestore in die ZIP-Datei
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+# Komprimierungsstufen je Eintragstyp für die parallele ZIP-Erzeugung (0 = unkomprimiert)
+ZIP_LEVEL_DEFAULTS = {'csv': 6, 'pdf': 0, 'xml': 6}
+# Belegte Spalten der Buchungsstapel- (125) und Partnerzeilen (243), siehe _create_datev_line/_create_partner_line
+BUCHUNGSSTAPEL_ROW = CompactRowEncoder(125, (0, 1, 2, 6, 7, 9, 10, 11, 13, 19))
+PARTNER_ROW = CompactRowEncoder(243, (0, 1, 3, 6, 9))
+
+# Monatsauswahl des Wizards und Anzahl wählbarer Jahre (aktuelles und vorherige)
+MONTHS = (
+    ('01', 'Januar'), ('02', 'Februar'), ('03', 'März'),
+    ('04', 'April'), ('05', 'Mai'), ('06', 'Juni'),
+    ('07', 'Juli'), ('08', 'August'), ('09', 'September'),
+    ('10', 'Oktober'), ('11', 'November'), ('12', 'Dezember'),
+)
+MONTH_NAMES = dict(MONTHS)
+SELECTABLE_YEARS = 3
+# Vorschau im Wizard: Ergebnisse je Prozess zwischenspeichern (Anzahl Einträge, Gültigkeit in Sekunden)
+PREVIEW_CACHE_SIZE = 256
+PREVIEW_CACHE_TTL = 60
+_preview_cache = LRU(PREVIEW_CACHE_SIZE)
+
+# Belegindex-Eintrag je Rechnung mit Haupt-Anhang: gemeinsame Quelle für Beleglink und document.xml
+DatevDocument = namedtuple('DatevDocument', [
+    'guid', 'attachment_id', 'filename', 'document_type', 'store_fname', 'file_size',
+])
+
+
+def _month_bounds(year, month):
+    """Erster und letzter Tag eines Monats"""
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _previous_month():
+    """Monat und Jahr des Vormonats als Auswahlwerte"""
+    last_day = date.today().replace(day=1) - timedelta(days=1)
+    return f"{last_day.month:02d}", str(last_day.year)
+
+
 class ExportWizard(models.TransientModel):
     _name = 'export.wizard'
     _description = 'Export Wizard'
@@ -48,11 +110,7 @@ class ExportWizard(models.TransientModel):
     )
 
     # Export-Konfiguration
-    invoice_type_filter = fields.Selection([
-        ('all', 'Rechnungen und Gutschriften'),
-        ('invoices_only', 'Nur Rechnungen'),
-        ('credit_notes_only', 'Nur Gutschriften')
-    ], string='Rechnungstyp', default='all', required=True)
+    invoice_type_filter = fields.Selection(INVOICE_TYPE_FILTERS, string='Rechnungstyp', default='all', required=True)
     
     export_mode = fields.Selection([
         ('21', 'Buchungsstapel'),
@@ -61,41 +119,74 @@ class ExportWizard(models.TransientModel):
     
     include_attachments = fields.Boolean(string='PDF Rechnungen & document.xml mit exportieren', default=False)
     is_company_only = fields.Boolean(string="Ist Unternehmen", default=True)
-    file_name = fields.Char(string="Dateiname", default="EXTF_datev_export.zip")
-    file_data = fields.Binary(string="Datei", readonly=True)
+    delta_export = fields.Boolean(
+        string='Nur neue/geänderte Buchungen',
+        default=False,
+        help='Exportiert nur Buchungen, die seit dem letzten erfolgreichen Export neu sind oder sich geändert haben'
+    )
+    split_volumes = fields.Boolean(
+        string='In Teile aufteilen',
+        default=False,
+        help='Teilt Buchungsstapel, PDFs und document.xml an Rechnungsgrenzen in eigenständige ZIP-Dateien'
+    )
+    volume_max_mb = fields.Integer(
+        string='Max. Größe je Teil (MB)',
+        default=lambda self: self._get_volume_default('volume_max_mb', 20),
+        help='Summe aus Buchungsstapel-CSV und PDFs je Teil vor der Komprimierung; 0 = keine Grenze'
+    )
+    volume_max_rows = fields.Integer(
+        string='Max. Buchungszeilen je Teil',
+        default=lambda self: self._get_volume_default('volume_max_rows', 0),
+        help='0 = keine Grenze'
+    )
+    profile_export = fields.Boolean(
+        string='cProfile aufzeichnen',
+        default=False,
+        help='Speichert zusätzlich ein cProfile-Abbild des Exportlaufs am Exportauftrag'
+    )
+    diagnostics_mode = fields.Boolean(
+        string='Diagnosemodus',
+        default=False,
+        help='Protokolliert eine Stichprobe der Rechnungen als JSONL-Anhang am Exportauftrag'
+    )
+    diagnostics_sample_rate = fields.Float(
+        string='Stichprobe (%)',
+        default=1.0,
+        help='Anteil der Rechnungen, die im Diagnosemodus protokolliert werden'
+    )
+    query_plan = fields.Text(string='Ausführungsplan', readonly=True)
+
+    # Vorschau des gewählten Zeitraums
+    preview_invoice_count = fields.Integer(string='Belege', compute='_compute_export_preview')
+    preview_partner_count = fields.Integer(string='Partner', compute='_compute_export_preview')
+    preview_attachment_info = fields.Char(string='PDF-Anhänge', compute='_compute_export_preview')
+
+    @api.model
+    def _get_volume_default(self, name, default):
+        """Voreinstellung der Teile-Grenzen aus den Systemparametern"""
+        value = self.env['ir.config_parameter'].sudo().get_param(f'custom_datev_export.{name}', default)
+        return max(int(value), 0)
 
     @api.model
     def _get_available_months(self):
         """Gibt alle Monate zurück"""
-        return [
-            ('01', 'Januar'), ('02', 'Februar'), ('03', 'März'),
-            ('04', 'April'), ('05', 'Mai'), ('06', 'Juni'),
-            ('07', 'Juli'), ('08', 'August'), ('09', 'September'),
-            ('10', 'Oktober'), ('11', 'November'), ('12', 'Dezember')
-        ]
+        return list(MONTHS)
 
     @api.model 
     def _get_available_years(self):
         """Gibt die letzten 3 Jahre zurück"""
-        today = date.today()
-        current_year = today.year
-        years = []
-        for i in range(3):
-            year = current_year - i
-            years.append((str(year), str(year)))
-        return years
+        current_year = date.today().year
+        return [(str(year), str(year)) for year in range(current_year, current_year - SELECTABLE_YEARS, -1)]
 
     @api.model
     def default_get(self, fields_list):
         """Setzt letzten Monat als Standard"""
         res = super().default_get(fields_list)
-        last_month = date.today() - relativedelta(months=1)
-        
+        month, year = _previous_month()
         if 'selected_month' in fields_list:
-            res['selected_month'] = f"{last_month.month:02d}"
+            res['selected_month'] = month
         if 'selected_year' in fields_list:
-            res['selected_year'] = str(last_month.year)
-            
+            res['selected_year'] = year
         return res
 
     @api.depends('use_date_range', 'selected_month', 'selected_year', 'start_date', 'end_date')
@@ -109,8 +200,7 @@ class ExportWizard(models.TransientModel):
                     record.date_info = "Bitte Von/Bis-Datum auswählen"
             else:
                 if record.selected_month and record.selected_year:
-                    months = dict(record._get_available_months())
-                    month_name = months.get(record.selected_month, record.selected_month)
+                    month_name = MONTH_NAMES.get(record.selected_month, record.selected_month)
                     record.date_info = f"{month_name} {record.selected_year}"
                 else:
                     record.date_info = "Bitte Monat und Jahr auswählen"
@@ -119,18 +209,12 @@ class ExportWizard(models.TransientModel):
     def _onchange_use_date_range(self):
         """Umschaltung zwischen Monat/Jahr und manuellem Datumsbereich"""
         if not self.use_date_range:
-            last_month = date.today() - relativedelta(months=1)
-            self.selected_month = f"{last_month.month:02d}"
-            self.selected_year = str(last_month.year)
+            self.selected_month, self.selected_year = _previous_month()
             self.start_date = False
             self.end_date = False
         else:
             if self.selected_month and self.selected_year:
-                year = int(self.selected_year)
-                month = int(self.selected_month)
-                self.start_date = date(year, month, 1)
-                last_day = calendar.monthrange(year, month)[1]
-                self.end_date = date(year, month, last_day)
+                self.start_date, self.end_date = _month_bounds(int(self.selected_year), int(self.selected_month))
 
     @api.onchange('export_mode')
     def _onchange_export_mode(self):
@@ -141,14 +225,12 @@ class ExportWizard(models.TransientModel):
             self.selected_year = False
             self.start_date = False
             self.end_date = False
-            self.invoice_type_filter = 'all'
+            self.invoice_type_filter = 'sales_and_purchases'
             self.include_attachments = False
             self.is_company_only = True
         elif self.export_mode == '21':  # Buchungsstapel
             # Default-Werte für Buchungsstapel wiederherstellen
-            last_month = date.today() - relativedelta(months=1)
-            self.selected_month = f"{last_month.month:02d}"
-            self.selected_year = str(last_month.year)
+            self.selected_month, self.selected_year = _previous_month()
             self.use_date_range = False
             self.start_date = False
             self.end_date = False
@@ -177,38 +259,151 @@ class ExportWizard(models.TransientModel):
         else:
             if not self.selected_month or not self.selected_year:
                 raise UserError(_("Bitte Monat und Jahr auswählen."))
-            
-            year = int(self.selected_year)
-            month = int(self.selected_month)
-            start_date = date(year, month, 1)
-            last_day = calendar.monthrange(year, month)[1]
-            end_date = date(year, month, last_day)
-            
-            return start_date, end_date
+            return _month_bounds(int(self.selected_year), int(self.selected_month))
+
+    def _has_export_period(self):
+        """Zeitraum vollständig gewählt (Debitoren/Kreditoren brauchen keinen)"""
+        if self.export_mode != '21':
+            return True
+        if self.use_date_range:
+            return bool(self.start_date and self.end_date)
+        return bool(self.selected_month and self.selected_year)
+
+    @api.depends('export_mode', 'use_date_range', 'selected_month', 'selected_year', 'start_date', 'end_date',
+                 'invoice_type_filter')
+    def _compute_export_preview(self):
+        """Vorschau auf Belege, Partner und PDF-Anhänge des gewählten Zeitraums"""
+        for record in self:
+            invoice_count, partner_count, attachment_count, attachment_size = record._get_export_preview()
+            record.preview_invoice_count = invoice_count
+            record.preview_partner_count = partner_count
+            record.preview_attachment_info = _('%(count)s Dateien, %(size)s') % {
+                'count': attachment_count,
+                'size': human_size(attachment_size),
+            }
+
+    def _get_export_preview(self):
+        """Belege, Partner, Haupt-Anhänge und deren Größe aus einer Aggregat-Abfrage
+
+        Das Ergebnis wird je Datenbank, Benutzer, Unternehmen, Zeitraum und Filter für
+        PREVIEW_CACHE_TTL Sekunden zwischengespeichert; Umschalten im Dialog fragt die
+        Datenbank daher nur für neue Kombinationen ab.
+        """
+        self.ensure_one()
+        if not self._has_export_period():
+            return 0, 0, 0, 0
+        date_from, date_to = self._get_export_date_range() if self.export_mode == '21' else (False, False)
+        key = (self.env.cr.dbname, self.env.uid, self.env.company.id, self.export_mode,
+               date_from, date_to, self.invoice_type_filter)
+        now = time.monotonic()
+        cached = _preview_cache.get(key)
+        if cached and now - cached[0] < PREVIEW_CACHE_TTL:
+            return cached[1]
+
+        query = self.env['account.move']._search(self._get_export_domain())
+        self.env['account.move'].flush_model(['partner_id', 'message_main_attachment_id'])
+        self.env['ir.attachment'].flush_model(['file_size'])
+        self.env.cr.execute(SQL("""
+            SELECT COUNT(move.id), COUNT(DISTINCT move.partner_id),
+                   COUNT(attachment.id), COALESCE(SUM(attachment.file_size), 0)
+              FROM account_move move
+         LEFT JOIN ir_attachment attachment ON attachment.id = move.message_main_attachment_id
+             WHERE move.id IN %s
+        """, query.subselect()))
+        result = self.env.cr.fetchone()
+        _preview_cache[key] = (now, result)
+        return result
 
     def action_export(self):
-        """Hauptmethode: Erstellt ZIP-Datei mit DATEV-Export"""
-        invoices = self._get_invoices_for_export()
-        if not invoices:
-            start_date, end_date = self._get_export_date_range()
-            raise UserError(_(
-                'Keine Rechnungen für den Zeitraum %s bis %s gefunden.\n\n'
-                'Tipp: Verwenden Sie "Manueller Datumsbereich" für ältere Zeiträume.'
-            ) % (start_date, end_date))
+        """Hauptmethode: Legt einen Exportauftrag an, der im Hintergrund verarbeitet wird
 
-        zip_data, file_name = self._create_export_zip(invoices)
-        
-        self.file_data = base64.b64encode(zip_data)
-        self.file_name = file_name
+        Liegt für dieselben Einstellungen und unveränderte Buchungen bereits ein fertiger
+        Export im Cache, wird dieser sofort ausgeliefert.
+        """
+        self.ensure_one()
+        job_vals = self._prepare_export_job_vals()
+        if self.delta_export:
+            if not self._get_invoices_for_export():
+                raise UserError(_('Keine neuen oder geänderten Buchungen seit dem letzten Export.'))
+        else:
+            fingerprint = self._get_export_fingerprint()
+            if fingerprint.startswith('0|'):
+                start_date, end_date = self._get_export_date_range()
+                raise UserError(_(
+                    'Keine Rechnungen für den Zeitraum %s bis %s gefunden.\n\n'
+                    'Tipp: Verwenden Sie "Manueller Datumsbereich" für ältere Zeiträume.'
+                ) % (start_date, end_date))
+            if self._is_export_cacheable():
+                cache_key = self._get_export_cache_key()
+                cache_entry = self.env['datev.export.cache']._lookup(cache_key, fingerprint)
+                if cache_entry:
+                    return cache_entry._get_download_action()
+                job_vals['cache_key'] = cache_key
+
+        job = self.env['datev.export.job'].create(job_vals)
+        job._trigger_processing()
+        return job._get_form_action()
 
+    def _is_export_cacheable(self):
+        """Delta-, Profiling- und Diagnoseläufe hängen nicht nur von den Buchungen ab, Teile-Exporte liefern mehrere Dateien"""
+        return not (self.delta_export or self.profile_export or self.diagnostics_mode or self._is_split_export())
+
+    def _is_split_export(self):
+        """Mehrteiliger Export: nur Buchungsstapel mit mindestens einer gesetzten Grenze"""
+        return bool(self.export_mode == '21' and self.split_volumes and (self.volume_max_mb or self.volume_max_rows))
+
+    def _get_export_cache_key(self):
+        """Cache-Schlüssel aus Unternehmen, Zeitraum und Filtern"""
+        self.ensure_one()
+        date_from, date_to = self._get_export_date_range() if self.export_mode == '21' else (False, False)
+        key = json.dumps([
+            self.env.company.id,
+            str(date_from or ''),
+            str(date_to or ''),
+            self.export_mode,
+            self.invoice_type_filter,
+            bool(self.include_attachments),
+            bool(self.is_company_only),
+        ])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _get_export_fingerprint(self):
+        """Günstiger Datenstand der passenden Buchungen: Anzahl und letzte Änderung von Buchungen und Partnern"""
+        self.ensure_one()
+        query = self.env['account.move']._search(self._get_export_domain())
+        self.env['account.move'].flush_model(['write_date', 'partner_id'])
+        self.env['res.partner'].flush_model(['write_date'])
+        self.env.cr.execute(SQL("""
+            SELECT COUNT(move.id), MAX(move.write_date), MAX(partner.write_date)
+              FROM account_move move
+         LEFT JOIN res_partner partner ON partner.id = move.partner_id
+             WHERE move.id IN %s
+        """, query.subselect()))
+        count, max_move_write_date, max_partner_write_date = self.env.cr.fetchone()
+        return f"{count}|{max_move_write_date or ''}|{max_partner_write_date or ''}"
+
+    def _prepare_export_job_vals(self):
+        """Übernimmt die Wizard-Einstellungen in einen Exportauftrag"""
+        self.ensure_one()
+        date_from, date_to = self._get_export_date_range() if self.export_mode == '21' else (False, False)
         return {
-            'type': 'ir.actions.act_url',
-            'url': f'/web/content?model=export.wizard&id={self.id}&field=file_data&filename_field=file_name&download=true',
-            'target': 'self',
+            'company_id': self.env.company.id,
+            'export_mode': self.export_mode,
+            'date_from': date_from,
+            'date_to': date_to,
+            'invoice_type_filter': self.invoice_type_filter,
+            'include_attachments': self.include_attachments,
+            'is_company_only': self.is_company_only,
+            'delta_export': self.delta_export,
+            'volume_max_bytes': self.volume_max_mb * 1024 * 1024 if self._is_split_export() else 0,
+            'volume_max_rows': self.volume_max_rows if self._is_split_export() else 0,
+            'profile_enabled': self.profile_export,
+            'diagnostics_mode': self.diagnostics_mode,
+            'diagnostics_sample_rate': self.diagnostics_sample_rate,
         }
 
-    def _get_invoices_for_export(self):
-        """Erstellt Domain-Filter und sucht passende Rechnungen"""
+    def _get_export_domain(self):
+        """Domain der zu exportierenden Rechnungen"""
         domain = []
         
         if self.export_mode == '21':
@@ -219,204 +414,582 @@ class ExportWizard(models.TransientModel):
             ]
         
         domain.append(('state', '=', 'posted'))
+        domain.append(('company_id', '=', self.env.company.id))
 
-        if self.invoice_type_filter == 'invoices_only':
-            domain.append(('move_type', '=', 'out_invoice'))
-        elif self.invoice_type_filter == 'credit_notes_only':
-            domain.append(('move_type', '=', 'out_refund'))
-        elif self.invoice_type_filter == 'all':
-            domain.append(('move_type', 'in', ['out_invoice', 'out_refund']))
+        domain.append(('move_type', 'in', list(INVOICE_TYPE_MOVE_TYPES[self.invoice_type_filter])))
+        return domain
 
+    def _get_invoices_for_export(self):
+        """Erstellt Domain-Filter und sucht passende Rechnungen"""
+        domain = self._get_export_domain()
         _logger.info("Rechnungssuche mit Domain: %s", domain)
-        invoices = self.env['account.move'].search(domain)
-        _logger.info("Gefundene Rechnungen: %d", len(invoices))
+        with self._export_stage('invoice_search') as stage:
+            # Sortierung nach ID erlaubt das stapelweise Fortsetzen abgebrochener Exportaufträge
+            invoices = self.env['account.move'].search(domain, order='id')
+            _logger.info("Gefundene Rechnungen: %d", len(invoices))
+
+            if self.export_mode == '21' and self.delta_export:
+                unchanged_ids = self.env['datev.export.ledger']._get_unchanged_move_ids(self.env.company, invoices.ids)
+                invoices = invoices.browse([move_id for move_id in invoices.ids if move_id not in unchanged_ids])
+                _logger.info("Delta-Export: %d neue oder geänderte Rechnungen", len(invoices))
+            stage.rows += len(invoices)
         
         return invoices
 
-    def _create_export_zip(self, invoices):
-        """Erstellt ZIP-Datei mit allen notwendigen Export-Dateien"""
-        buffer = io.BytesIO()
-        
+    def action_explain_export_query(self):
+        """Zeigt den Ausführungsplan der Rechnungssuche mit geschätzten Kosten an (Entwicklermodus)"""
+        self.ensure_one()
+        query = self.env['account.move']._search(self._get_export_domain(), order='id')
+        self.env.cr.execute(SQL("EXPLAIN (FORMAT JSON) %s", query.select()))
+        plan = self.env.cr.fetchone()[0][0]['Plan']
+        self.env.cr.execute(SQL("EXPLAIN %s", query.select()))
+        plan_lines = [line for line, in self.env.cr.fetchall()]
+
+        index_names = set()
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Index Name'):
+                index_names.add(node['Index Name'])
+            nodes.extend(node.get('Plans', []))
+
+        self.query_plan = '\n'.join([
+            _('Geschätzte Kosten: %(startup).2f..%(total).2f, geschätzte Zeilen: %(rows)d',
+              startup=plan['Startup Cost'], total=plan['Total Cost'], rows=plan['Plan Rows']),
+            _('Verwendete Indizes: %s', ', '.join(sorted(index_names)) or '-'),
+            _('Export-Index %(index)s verwendet: %(used)s',
+              index=DATEV_EXPORT_INDEX, used=_('ja') if DATEV_EXPORT_INDEX in index_names else _('nein')),
+            '',
+            *plan_lines,
+        ])
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _get_export_date_str(self):
+        """Datumsteil der Dateinamen"""
         if self.export_mode == '21':
             start_date, end_date = self._get_export_date_range()
             if start_date.replace(day=1) == end_date.replace(day=calendar.monthrange(end_date.year, end_date.month)[1]):
                 # Ganzer Monat: MM.YYYY
-                date_str = f"{start_date.strftime('%m.%Y')}"
-            else:
-                # Datumsbereich: DD.MM.YYYY_bis_DD.MM.YYYY
-                date_str = f"{start_date.strftime('%d.%m.%Y')}_bis_{end_date.strftime('%d.%m.%Y')}"
-        else:
-            # Debitoren/Kreditoren: DD.MM.YYYY
-            date_str = fields.Date.today().strftime('%d.%m.%Y')
+                return f"{start_date.strftime('%m.%Y')}"
+            # Datumsbereich: DD.MM.YYYY_bis_DD.MM.YYYY
+            return f"{start_date.strftime('%d.%m.%Y')}_bis_{end_date.strftime('%d.%m.%Y')}"
+        # Debitoren/Kreditoren: DD.MM.YYYY
+        return fields.Date.today().strftime('%d.%m.%Y')
+
+    def _write_export_zip(self, fileobj, invoices, buchungsstapel_file=None, document_index=None):
+        """Schreibt die ZIP-Datei stapelweise in fileobj und gibt den Dateinamen zurück
+
+        Ist buchungsstapel_file gesetzt (bereits geschriebene Buchungsstapel-CSV), wird die
+        Datei unverändert übernommen statt neu erzeugt. document_index ist der Belegindex aus
+        _get_document_index; fehlt er, wird er für die PDFs hier einmalig aufgebaut, für die
+        Beleglinks der Buchungszeilen nur je Stapel für Rechnungen ohne Snapshot.
+        """
+        date_str = self._get_export_date_str()
+        if self.export_mode == '21' and self.include_attachments and document_index is None:
+            document_index = self._get_document_index(invoices)
         
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_workers, zip_levels = self._get_zip_settings()
+        with self._export_stage('zip') as zip_stage, \
+                zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zip_file, \
+                (ParallelZipWriter(zip_file, zip_workers) if zip_workers else nullcontext()) as members:
             if self.export_mode == '21':
                 base_name = 'EXTF_datev_export_Buchungsstapel'
                 if self.include_attachments:
                     base_name += '_PDF'
 
-                zip_file.writestr(
-                    f'{base_name}_{date_str}.csv',
-                    self._generate_csv_content(invoices)
-                )
-
-                filtered_partners = invoices.mapped('partner_id').filtered(
-                    lambda p: (
-                        p and
-                        p.property_account_receivable_id and
-                        p.property_account_receivable_id.code and
-                        p.is_company
-                    )
-                )
+                csv_file_name = f'{base_name}_{date_str}.csv'
+                if buchungsstapel_file and members is not None:
+                    members.add(csv_file_name, buchungsstapel_file, zip_levels['csv'])
+                elif buchungsstapel_file:
+                    with zip_file.open(zip_member_info(csv_file_name, zip_levels['csv']), 'w',
+                                       force_zip64=True) as member:
+                        buchungsstapel_file.seek(0)
+                        shutil.copyfileobj(buchungsstapel_file, member)
+                else:
+                    with self._open_export_member(zip_file, csv_file_name, 'buchungsstapel_csv',
+                                                  members, zip_levels['csv']) as member:
+                        self._write_csv_content(member, invoices, document_index=document_index)
+
+                filtered_partners = [
+                    partner for partner in self._get_invoice_partner_data(invoices)
+                    if partner['account_code'] and partner['is_company']
+                ]
                 if filtered_partners:
-                    zip_file.writestr(
-                        f'EXTF_datev_export_Debitoren_Kreditoren_Buchungsstapel_{date_str}.csv',
-                        self._generate_filtered_partner_csv(filtered_partners)
-                    )
+                    partner_file_name = f'EXTF_datev_export_Debitoren_Kreditoren_Buchungsstapel_{date_str}.csv'
+                    with self._open_export_member(zip_file, partner_file_name, 'partner_csv',
+                                                  members, zip_levels['csv']) as member:
+                        self._write_partner_rows(member, filtered_partners)
 
                 if self.include_attachments:
-                    attachments = invoices.filtered(lambda m: m.message_main_attachment_id)
-                    documents = []
-                    for invoice in attachments:
-                        attachment = invoice.message_main_attachment_id
-                        zip_file.writestr(attachment.name, attachment.raw)
-                        documents.append({
-                            'guid': invoice._l10n_de_datev_get_guid(),
-                            'filename': attachment.name,
-                            'type': 2 if invoice.is_sale_document() else 1 if invoice.is_purchase_document() else None,
-                        })
-                    if documents:
-                        zip_file.writestr('document.xml', self._generate_document_xml(documents))
+                    documents = self._write_invoice_attachments(zip_file, invoices, document_index,
+                                                                members, zip_levels['pdf'])
+                    if documents and members is not None:
+                        members.add_bytes('document.xml', self._generate_document_xml(documents).encode('utf-8'),
+                                          zip_levels['xml'])
+                    elif documents:
+                        zip_file.writestr(zip_member_info('document.xml', zip_levels['xml']),
+                                          self._generate_document_xml(documents))
 
             else:
                 base_name = 'EXTF_datev_export_Debitoren_Kreditoren'
-                partners = invoices.mapped('partner_id')
+                partners = self._get_invoice_partner_data(invoices)
                 if self.is_company_only:
-                    partners = partners.filtered(lambda p: p.is_company)
+                    partners = [partner for partner in partners if partner['is_company']]
                 if not partners:
                     raise UserError(_('Keine passenden Partner für Debitoren/Kreditoren-Export gefunden.'))
                 
-                zip_file.writestr(
-                    f'{base_name}_{date_str}.csv',
-                    self._generate_filtered_partner_csv(partners)
-                )
-
-        buffer.seek(0)
-        return buffer.read(), f'{base_name}_{date_str}.zip'
-
-    def _prepare_buchungsstapel(self, invoices):
-        """Gruppiert Rechnungspositionen nach Erlöskonto"""
-        _logger.info("DATEV Buchungsstapel Vorbereitung START")
-        lines = []
-        
-        for inv in invoices:
-            _logger.info("Verarbeite Rechnung: %s (Gesamtbetrag: %s)", inv.name, inv.amount_total)
-            account_groups = self._group_invoice_lines_by_account(inv)
-            
-            for account_code, total_amount in account_groups.items():
-                _logger.info("Erstelle Export-Zeile: Konto=%s, Betrag=%s", account_code, total_amount)
-                export_line = self._create_datev_line(inv, account_code, total_amount)
-                lines.append(export_line)
-        
-        _logger.info("DATEV Buchungsstapel Vorbereitung ENDE: %d Zeilen erstellt", len(lines))
-        return lines
+                partner_file_name = f'{base_name}_{date_str}.csv'
+                with self._open_export_member(zip_file, partner_file_name, 'partner_csv',
+                                              members, zip_levels['csv']) as member:
+                    self._write_partner_rows(member, partners)
 
-    def _group_invoice_lines_by_account(self, invoice):
-        """Gruppiert die Rechnungspositionen einer Rechnung nach Erlöskonto"""
-        account_groups = defaultdict(float)
-        
-        _logger.info("Analysiere %d Rechnungspositionen:", len(invoice.invoice_line_ids))
-        
-        for i, line in enumerate(invoice.invoice_line_ids, 1):
-            account_code = line.account_id.code if line.account_id else None
-            _logger.info("Position %d: %s | Konto: %s | Betrag: %s", 
-                        i, line.name or 'Ohne Name', account_code or 'KEIN KONTO', line.price_total)
+        zip_stage.bytes += fileobj.tell()
+        return f'{base_name}_{date_str}.zip'
+
+    def _get_zip_settings(self):
+        """Anzahl Komprimierungs-Threads (0 = sequentiell) und Komprimierungsstufe je Eintragstyp"""
+        ICP = self.env['ir.config_parameter'].sudo()
+        workers = max(int(ICP.get_param('custom_datev_export.zip_workers', 0)), 0)
+        levels = {
+            member_type: min(max(int(ICP.get_param(f'custom_datev_export.zip_level_{member_type}', default)), 0), 9)
+            for member_type, default in ZIP_LEVEL_DEFAULTS.items()
+        }
+        return workers, levels
+
+    @contextmanager
+    def _open_export_member(self, zip_file, name, stage_name, members=None, level=None):
+        """Textstrom für einen CSV-Eintrag; die unkomprimierte Größe wird der Phase stage_name zugerechnet
+
+        Ohne members wird direkt mit Stufe level in die ZIP-Datei geschrieben. Mit members (ParallelZipWriter)
+        entsteht der Inhalt in einer temporären Datei und wird im Thread-Pool komprimiert.
+        """
+        if members is None:
+            with self._open_zip_text_member(zip_file, name, level) as stream:
+                yield stream
+            size = zip_file.getinfo(name).file_size
+        else:
+            buffer = tempfile.TemporaryFile()
+            stream = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+            try:
+                yield stream
+                stream.flush()
+                size = buffer.tell()
+                stream.detach()
+            except BaseException:
+                stream.close()
+                raise
+            members.add(name, buffer, level, close_source=True)
+        self._export_stats_add(stage_name, bytes=size)
+
+    def _get_invoice_attachment_data(self, invoices):
+        """Liest die Metadaten der Haupt-Anhänge aller Rechnungen mit einer Abfrage
+
+        Liefert Tupel (move_id, attachment_id, name, store_fname, file_size) in Rechnungsreihenfolge.
+        """
+        if not invoices:
+            return []
+        self.env['account.move'].flush_model(['message_main_attachment_id'])
+        self.env['ir.attachment'].flush_model(['name', 'store_fname', 'file_size'])
+        self.env.cr.execute("""
+            SELECT move.id, attachment.id, attachment.name, attachment.store_fname, attachment.file_size
+              FROM account_move move
+              JOIN ir_attachment attachment ON attachment.id = move.message_main_attachment_id
+             WHERE move.id = ANY(%s)
+             ORDER BY move.id
+        """, [invoices.ids])
+        return self.env.cr.fetchall()
+
+    def _get_document_index(self, invoices):
+        """Baut den Belegindex {move_id: DatevDocument} für alle Rechnungen mit Haupt-Anhang auf
+
+        Anhangsdaten kommen aus einer Abfrage, GUID und Belegtyp werden je Rechnung genau
+        einmal bestimmt und von Beleglink (Spalte 20) und document.xml gemeinsam genutzt.
+        """
+        with self._export_stage('document_index') as stage:
+            document_index = {}
+            for chunk in split_every(EXPORT_BATCH_SIZE, self._get_invoice_attachment_data(invoices), list):
+                moves = invoices.browse([row[0] for row in chunk])
+                for move, (move_id, attachment_id, name, store_fname, file_size) in zip(moves, chunk):
+                    document_index[move_id] = DatevDocument(
+                        guid=move._l10n_de_datev_get_guid(),
+                        attachment_id=attachment_id,
+                        filename=name,
+                        document_type=2 if move.is_sale_document() else 1 if move.is_purchase_document() else None,
+                        store_fname=store_fname,
+                        file_size=file_size or 0,
+                    )
+                self._invalidate_export_cache()
+            stage.rows += len(document_index)
+        return document_index
+
+    def _write_invoice_attachments(self, zip_file, invoices, document_index, members=None, level=0):
+        """Überträgt die PDF-Anhänge blockweise aus dem Filestore in die ZIP-Datei
+
+        PDFs sind bereits komprimiert; die Stufe level (Standard 0) legt sie daher meist
+        unkomprimiert (ZIP_STORED) ab. Mit members (ParallelZipWriter) werden sie im Thread-Pool
+        übertragen. Fehlt die Datei im Filestore, wird der Fehler protokolliert und ein leerer
+        Eintrag geschrieben, damit Beleglink (Spalte 20) und document.xml weiterhin auf eine Datei
+        im Paket verweisen. Gibt die Einträge für document.xml zurück.
+        """
+        IrAttachment = self.env['ir.attachment']
+        documents = []
+        with self._export_stage('attachments') as stage:
+            for move_id in invoices.ids:
+                document = document_index.get(move_id)
+                if not document:
+                    continue
+                if members is not None:
+                    if document.store_fname:
+                        path = IrAttachment._full_path(document.store_fname)
+                        if os.path.isfile(path):
+                            members.add(document.filename, path, level)
+                        else:
+                            self._log_missing_attachment(document, path)
+                            members.add_bytes(document.filename, b'', level)
+                    else:
+                        members.add_bytes(document.filename, IrAttachment.browse(document.attachment_id).raw or b'', level)
+                else:
+                    self._write_attachment_member(zip_file, document, level)
+                stage.rows += 1
+                stage.bytes += document.file_size
+                documents.append({
+                    'guid': document.guid,
+                    'filename': document.filename,
+                    'type': document.document_type,
+                })
+        _logger.info("DATEV Export: %d Anhänge übertragen", len(documents))
+        return documents
+
+    def _write_attachment_member(self, zip_file, document, level=0):
+        """Kopiert einen Anhang mit Stufe level (0 = ZIP_STORED) in die ZIP-Datei
+
+        Die Quelldatei wird vor dem Local File Header geöffnet; fehlt sie im Filestore, entsteht
+        ein leerer Eintrag (wie beim früheren Lesen über attachment.raw).
+        """
+        IrAttachment = self.env['ir.attachment']
+        source = None
+        missing = False
+        if document.store_fname:
+            path = IrAttachment._full_path(document.store_fname)
+            try:
+                source = open(path, 'rb')
+            except FileNotFoundError:
+                self._log_missing_attachment(document, path)
+                missing = True
+        zip_info = zip_member_info(document.filename, level)
+        zip_info.file_size = 0 if missing else document.file_size
+        with zip_file.open(zip_info, 'w') as member:
+            if source:
+                with source:
+                    shutil.copyfileobj(source, member, ATTACHMENT_CHUNK_SIZE)
+            elif not missing:
+                # In der Datenbank gespeicherte Anhänge haben keine Datei im Filestore
+                member.write(IrAttachment.browse(document.attachment_id).raw or b'')
+
+    @api.model
+    def _log_missing_attachment(self, document, path):
+        _logger.warning("DATEV Export: Anhang %s (ID %s) fehlt im Filestore (%s), leerer Eintrag wird geschrieben",
+                        document.filename, document.attachment_id, path)
+
+    @api.model
+    def _open_zip_text_member(self, zip_file, name, level=None):
+        """Öffnet einen ZIP-Eintrag zum zeilenweisen Schreiben als UTF-8-Text (Stufe level, sonst die der ZIP-Datei)"""
+        target = name if level is None else zip_member_info(name, level)
+        return io.TextIOWrapper(zip_file.open(target, 'w', force_zip64=True), encoding='utf-8', newline='')
+
+    def _iter_invoice_batches(self, invoices, batch_size=EXPORT_BATCH_SIZE, prefetch=True):
+        """Teilt die Rechnungen in ID-Stapel fester Größe auf
+
+        Kopfdaten, Partner und Konten eines Stapels werden gemeinsam vorgeladen (prefetch), nach
+        dem Stapel wird der ORM-Cache geleert. Der Speicherbedarf hängt so von der Stapelgröße
+        und nicht von der Länge des Zeitraums ab.
+        """
+        for batch_ids in split_every(batch_size, invoices.ids, list):
+            batch = invoices.browse(batch_ids)
+            if prefetch:
+                self._prefetch_invoice_batch(batch)
+            yield batch
+            self._invalidate_export_cache()
+
+    def _prefetch_invoice_batch(self, batch):
+        """Lädt die für Buchungszeilen benötigten Felder des Stapels mit wenigen Abfragen"""
+        with self._export_stage('batch_prefetch') as stage:
+            batch.fetch(['name', 'move_type', 'partner_id', 'currency_id', 'invoice_date', 'invoice_date_due',
+                         'amount_total'])
+            partners = batch.partner_id
+            partners.fetch(['name', 'parent_id', 'property_account_receivable_id', 'property_account_payable_id'])
+            (partners.parent_id - partners).fetch(['name'])
+            (partners.property_account_receivable_id | partners.property_account_payable_id).fetch(['code'])
+            batch.currency_id.fetch(['name'])
+            stage.rows += len(batch)
+
+    def _invalidate_export_cache(self):
+        """Leert den ORM-Cache der Exportmodelle; der Wizard selbst bleibt unberührt
+
+        Unterbleibt bei Aufrufen aus laufenden Schreibvorgängen (Snapshot-Pflege beim Buchen).
+        """
+        if self.env.context.get('datev_export_keep_cache'):
+            return
+        for model_name in EXPORT_CACHE_MODELS:
+            self.env[model_name].invalidate_model()
+
+    def _iter_buchungsstapel_moves(self, invoices, document_index=None):
+        """Liefert je Rechnung die Buchungsstapel-Zeilen als (Rechnung, Zeilen)
+
+        Die Zeilen kommen aus aktuellen Snapshots (datev.booking.snapshot); nur für Rechnungen
+        ohne aktuellen Snapshot wird live gruppiert und der Snapshot nachgetragen. Im Delta-Export
+        werden Rechnungen übersprungen, deren Zeilen unverändert bereits exportiert wurden.
+        Ohne document_index wird der Belegindex je Stapel aufgebaut.
+        """
+        Ledger = self.env['datev.export.ledger']
+        Snapshot = self.env['datev.booking.snapshot']
+        tracer = self.env.context.get(TRACE_CONTEXT_KEY)
+        for batch in self._iter_invoice_batches(invoices, prefetch=False):
+            with self._export_stage('snapshot_read') as stage:
+                rows_by_move = Snapshot._get_fresh_rows(batch)
+                stage.rows += len(rows_by_move)
+            snapshot_ids = set(rows_by_move)
+            missing = batch.browse([move_id for move_id in batch.ids if move_id not in snapshot_ids])
+            if missing:
+                self._prefetch_invoice_batch(missing)
+                computed = self._compute_booking_rows(missing, document_index)
+                Snapshot._store(computed)
+                rows_by_move.update(computed)
+            exported_hashes = Ledger._get_exported_hashes(self.env.company, batch.ids) if self.delta_export else {}
             
-            if not account_code:
-                _logger.warning("Position %d übersprungen (kein Erlöskonto gesetzt)", i)
+            for inv in batch:
+                rows = rows_by_move[inv.id]
+
+                unchanged = inv.id in exported_hashes and exported_hashes[inv.id] == self._get_move_content_hash(rows)
+                if tracer and tracer.is_sampled(inv.id):
+                    tracer.write({
+                        'move_id': inv.id,
+                        'name': inv.name,
+                        'move_type': inv.move_type,
+                        'amount_total': inv.amount_total,
+                        'account_groups': {row[3]: row[0] for row in rows},
+                        'rows': len(rows),
+                        'snapshot': inv.id in snapshot_ids,
+                        'skipped_unchanged': unchanged,
+                    })
+                if unchanged:
+                    continue
+                yield inv, rows
+
+    def _compute_booking_rows(self, invoices, document_index=None):
+        """Berechnet die Buchungsstapel-Zeilen {move_id: [Zeilen]} live aus den Rechnungspositionen"""
+        account_groups_by_move = self._aggregate_invoice_lines(invoices)
+        documents = document_index if document_index is not None else self._get_document_index(invoices)
+        return {
+            inv.id: [
+                self._create_datev_line(inv, account_code, total_amount, documents.get(inv.id))
+                for account_code, total_amount in account_groups_by_move[inv.id].items()
+            ]
+            for inv in invoices
+        }
+
+    @api.model
+    def _get_move_content_hash(self, rows):
+        """SHA-1 über die Buchungsstapel-Zeilen einer Rechnung"""
+        content = '\n'.join(BUCHUNGSSTAPEL_ROW.join(row) for row in rows)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _aggregate_invoice_lines(self, invoices):
+        """Summiert die Positionen aller Ausgangs- und Eingangsbelege in einer Gruppierungsabfrage nach Sachkonto
+
+        Liefert {move_id: {Kontonummer: Betrag}}. Die Konten eines Belegs stehen in der
+        Reihenfolge ihrer ersten Position, Belege ohne Sachkonto erhalten den Fallback 4400
+        (Ausgangsbelege) bzw. 3400 (Eingangsbelege).
+        """
+        with self._export_stage('line_grouping') as stage:
+            groups = self.env['account.move.line']._read_group(
+                domain=[
+                    ('move_id', 'in', invoices.ids),
+                    ('display_type', 'in', ('product', 'line_section', 'line_note')),
+                    ('account_id', '!=', False),
+                ],
+                groupby=['move_id', 'account_id'],
+                aggregates=['price_total:sum', 'id:min'],
+            )
+            stage.rows += len(groups)
+        # Sortierung nach erster Position entspricht der Reihenfolge von invoice_line_ids
+        groups.sort(key=lambda group: (group[0].id, group[3]))
+
+        account_groups_by_move = defaultdict(lambda: defaultdict(float))
+        for move, account, price_total, _first_line_id in groups:
+            if not account.code:
                 continue
-            
-            account_groups[account_code] += line.price_total
-            _logger.info("Zu Konto %s addiert: %s (Neue Summe: %s)", 
-                        account_code, line.price_total, account_groups[account_code])
-        
-        if not account_groups:
-            _logger.warning("WARNUNG: Keine Positionen mit Erlöskonto! Verwende Fallback 4400")
-            account_groups['4400'] = invoice.amount_total
-        
-        _logger.info("Finale Kontogruppen: %s", dict(account_groups))
-        return account_groups
+            account_groups_by_move[move.id][account.code] += price_total
 
-    def _create_datev_line(self, invoice, account_code, amount):
-        """Erstellt eine einzelne DATEV-Export-Zeile"""
-        array = [''] * 125
-        
-        array[0] = f"{amount:.2f}".replace('.', ',')  # Umsatz
-        array[1] = 'H' if invoice.move_type == 'out_invoice' else 'S'  # Soll/Haben
-        array[2] = invoice.currency_id.name or ''  # Währung
-        array[6] = account_code  # Erlöskonto
-        array[7] = invoice.partner_id.property_account_receivable_id.code or ''  # Debitorenkonto
-        array[9] = invoice.invoice_date.strftime('%d%m') if invoice.invoice_date else ''  # Belegdatum
-        array[10] = invoice.name or ''  # Rechnungsnummer
-        array[11] = invoice.invoice_date_due.strftime('%d%m%y') if invoice.invoice_date_due else ''  # Fälligkeit
-        
-        partner_name = invoice.partner_id.parent_id.name if invoice.partner_id.parent_id else invoice.partner_id.name
-        array[13] = partner_name or ''  # Buchungstext
-        
-        if invoice.message_main_attachment_id:
-            array[19] = f'BEDI "{invoice._l10n_de_datev_get_guid()}"'
-        
-        return array
+        result = {}
+        fallback_names = []
+        for invoice in invoices:
+            account_groups = account_groups_by_move.get(invoice.id)
+            if not account_groups:
+                fallback_names.append(invoice.name)
+                fallback_account = FALLBACK_PURCHASE_ACCOUNT if invoice.move_type in PURCHASE_MOVE_TYPES else FALLBACK_SALE_ACCOUNT
+                account_groups = {fallback_account: invoice.amount_total}
+            result[invoice.id] = dict(account_groups)
 
-    def _generate_csv_content(self, invoices):
-        """Generiert den CSV-Inhalt basierend auf Exportmodus"""
-        output = StringIO()
-        writer = csv.writer(output, delimiter=';', quotechar="'", quoting=csv.QUOTE_MINIMAL)
+        if fallback_names:
+            _logger.warning("%d Belege ohne Positionen mit Sachkonto, verwende Fallback %s/%s: %s",
+                            len(fallback_names), FALLBACK_SALE_ACCOUNT, FALLBACK_PURCHASE_ACCOUNT,
+                            ', '.join(fallback_names[:10]) + (' ...' if len(fallback_names) > 10 else ''))
+        _logger.debug("Kontogruppierung für %d Rechnungen: %d Gruppen", len(invoices), len(groups))
+        return result
+
+    def _create_datev_line(self, invoice, account_code, amount, document=None):
+        """Erstellt eine einzelne DATEV-Export-Zeile als kompakte Zeile (Spalten siehe BUCHUNGSSTAPEL_ROW)
+
+        document ist der Belegindex-Eintrag der Rechnung.
+        """
+        partner = invoice.partner_id
+        partner_name = partner.parent_id.name if partner.parent_id else partner.name
+        if invoice.move_type in PURCHASE_MOVE_TYPES:
+            partner_account = partner.property_account_payable_id
+        else:
+            partner_account = partner.property_account_receivable_id
+        return (
+            f"{amount:.2f}".replace('.', ','),  # 0: Umsatz
+            SOLL_HABEN[invoice.move_type],  # 1: Soll/Haben
+            invoice.currency_id.name or '',  # 2: Währung
+            account_code,  # 6: Erlös- bzw. Aufwandskonto
+            partner_account.code or '',  # 7: Debitoren- bzw. Kreditorenkonto
+            invoice.invoice_date.strftime('%d%m') if invoice.invoice_date else '',  # 9: Belegdatum
+            invoice.name or '',  # 10: Rechnungsnummer
+            invoice.invoice_date_due.strftime('%d%m%y') if invoice.invoice_date_due else '',  # 11: Fälligkeit
+            partner_name or '',  # 13: Buchungstext
+            f'BEDI "{document.guid}"' if document else '',  # 19: Beleglink
+        )
+
+    @api.model
+    def _encode_buchungsstapel_rows(self, rows):
+        """CSV-Text der kompakten Buchungsstapel-Zeilen"""
+        return BUCHUNGSSTAPEL_ROW.encode_many(rows)
+
+    def _write_csv_content(self, stream, invoices, document_index=None):
+        """Schreibt den CSV-Inhalt zeilenweise in stream"""
+        writer = self._get_csv_writer(stream)
 
         self._write_datev_header(writer)
 
         if self.export_mode == '21':
             writer.writerow(self._get_buchungsstapel_header())
-            writer.writerows(self._prepare_buchungsstapel(invoices))
+            row_count = self._write_buchungsstapel_rows(stream, invoices, document_index)
+            _logger.info("DATEV Buchungsstapel geschrieben: %d Zeilen", row_count)
         elif self.export_mode == '16':
             writer.writerow(self._get_partnerliste_header())
-            writer.writerows(self._prepare_partner_list(invoices))
+            stream.write(PARTNER_ROW.encode_many(self._prepare_partner_list(invoices)))
+
+    @api.model
+    def _get_csv_writer(self, stream):
+        """CSV-Writer im DATEV-Format (Semikolon, Hochkomma)"""
+        return csv.writer(stream, delimiter=';', quotechar="'", quoting=csv.QUOTE_MINIMAL)
+
+    def _export_stage(self, name):
+        """Misst eine Exportphase, sofern ein Profiler im Kontext übergeben wurde"""
+        profiler = self.env.context.get(PROFILER_CONTEXT_KEY)
+        return profiler.stage(name) if profiler else null_stage()
 
-        return output.getvalue()
+    def _export_stats_add(self, name, rows=0, bytes=0):
+        """Ergänzt Zeilen/Bytes einer Phase im Profiler des Kontexts"""
+        profiler = self.env.context.get(PROFILER_CONTEXT_KEY)
+        if profiler:
+            profiler.add(name, rows=rows, bytes=bytes)
 
-    def _generate_filtered_partner_csv(self, partners):
-        """Generiert CSV nur für Partner"""
-        output = StringIO()
-        writer = csv.writer(output, delimiter=';', quotechar="'", quoting=csv.QUOTE_MINIMAL)
+    def _write_buchungsstapel_rows(self, stream, invoices, document_index=None):
+        """Schreibt die Buchungszeilen der Rechnungen und gibt die Zeilenanzahl zurück"""
+        row_count = 0
+        with self._export_stage('buchungsstapel_csv') as stage:
+            for _invoice, rows in self._iter_buchungsstapel_moves(invoices, document_index):
+                stream.write(BUCHUNGSSTAPEL_ROW.encode_many(rows))
+                row_count += len(rows)
+            stage.rows += row_count
+        return row_count
+
+    def _write_partner_rows(self, stream, partner_data):
+        """Schreibt Header und Partnerzeilen aus vorab gelesenen Partnerdaten"""
+        writer = self._get_csv_writer(stream)
         writer.writerow(self._get_partnerliste_header())
 
-        for partner in partners:
-            array = [''] * 243
-            array[0] = partner.property_account_receivable_id.code if partner.property_account_receivable_id else ''
-            array[1] = partner.name if partner.is_company else ''
-            array[3] = '' if partner.is_company else partner.name
-            array[6] = '2' if partner.is_company else '1'
-            array[9] = partner.vat or ''
-            writer.writerow(array)
+        with self._export_stage('partner_csv') as stage:
+            for partner in partner_data:
+                stream.write(PARTNER_ROW.encode(self._create_partner_line(partner)))
+            stage.rows += len(partner_data)
+
+    @api.model
+    def _create_partner_line(self, partner):
+        """Erstellt eine kompakte Zeile der Partnerliste (Spalten siehe PARTNER_ROW) aus _get_partner_export_data"""
+        return (
+            partner['account_code'],  # 0: Konto
+            partner['name'] if partner['is_company'] else '',  # 1: Name (Unternehmen)
+            '' if partner['is_company'] else partner['name'],  # 3: Name (natürliche Person)
+            '2' if partner['is_company'] else '1',  # 6: Adressattyp
+            partner['vat'],  # 9: EU-UStID
+        )
+
+    def _get_invoice_partners(self, invoices, move_types=SALE_MOVE_TYPES):
+        """Partner der Belege der angegebenen Belegarten in Reihenfolge ihres ersten Auftretens"""
+        if not invoices:
+            return self.env['res.partner']
+        self.env['account.move'].flush_model(['partner_id', 'move_type'])
+        self.env.cr.execute("""
+            SELECT partner_id
+              FROM account_move
+             WHERE id = ANY(%s) AND partner_id IS NOT NULL AND move_type = ANY(%s)
+          GROUP BY partner_id
+          ORDER BY MIN(id)
+        """, [invoices.ids, list(move_types)])
+        return self.env['res.partner'].browse([partner_id for partner_id, in self.env.cr.fetchall()])
+
+    def _get_invoice_partner_data(self, invoices):
+        """Partnerdaten der Belege: Debitoren aus Ausgangsbelegen, danach Kreditoren aus Eingangsbelegen"""
+        return (
+            self._get_partner_export_data(self._get_invoice_partners(invoices, SALE_MOVE_TYPES))
+            + self._get_partner_export_data(self._get_invoice_partners(invoices, PURCHASE_MOVE_TYPES),
+                                            account_field='property_account_payable_id')
+        )
+
+    def _get_partner_export_data(self, partners, account_field='property_account_receivable_id'):
+        """Liest Name, Unternehmenskennzeichen, USt-IdNr. und Personenkonto aller Partner gebündelt
+
+        account_field ist das Debitoren- oder Kreditorenkonto. Das firmenabhängige Konto wird je
+        Stapel für alle Partner zusammen aufgelöst, die Kontonummern danach in einem Durchgang
+        gelesen. Liefert eine Liste von Dicts.
+        """
+        with self._export_stage('partner_fetch') as stage:
+            partner_data = []
+            for chunk_ids in split_every(EXPORT_BATCH_SIZE, partners.ids, list):
+                chunk = partners.browse(chunk_ids)
+                chunk.fetch(['name', 'is_company', 'vat', account_field])
+                accounts = chunk[account_field]
+                account_codes = {account.id: account.code or '' for account in accounts}
 
-        return output.getvalue()
+                for partner in chunk:
+                    account = partner[account_field]
+                    partner_data.append({
+                        'id': partner.id,
+                        'name': partner.name,
+                        'is_company': partner.is_company,
+                        'vat': partner.vat or '',
+                        'account_code': account_codes.get(account.id, '') if account else '',
+                    })
+                self._invalidate_export_cache()
+            stage.rows += len(partner_data)
+        return partner_data
 
     def _prepare_partner_list(self, invoices):
         """Bereitet Partner-Liste für Export vor"""
-        partner_ids = invoices.mapped('partner_id').filtered(lambda p: p)
+        partner_data = self._get_invoice_partner_data(invoices)
         if self.is_company_only:
-            partner_ids = partner_ids.filtered(lambda p: p.is_company)
-
-        lines = []
-        for partner in partner_ids:
-            array = [''] * 243
-            array[0] = partner.property_account_receivable_id.code if partner.property_account_receivable_id else ''
-            array[1] = partner.name if partner.is_company else ''
-            array[3] = '' if partner.is_company else partner.name
-            array[6] = '2' if partner.is_company else '1'
-            array[9] = partner.vat or ''
-            lines.append(array)
-        return lines
+            partner_data = [partner for partner in partner_data if partner['is_company']]
+        return [self._create_partner_line(partner) for partner in partner_data]
 
     def _write_datev_header(self, writer):
         """Schreibt den DATEV-spezifischen Header"""